@@ -1,4 +1,5 @@
 import json
+import math
 import os
 import faiss
 import sys
@@ -64,30 +65,48 @@ def regenerate_faiss_index():
     # Crear embeddings
     print("🔄 Generando embeddings...")
     texts = [doc['content'] for doc in documents]
-    embeddings = model.encode(texts, show_progress_bar=True)
+    embeddings = model.encode(
+        texts,
+        batch_size=64,
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=True
+    )
     
     # Crear índice FAISS
     print("\n📦 Creando índice FAISS...")
     dimension = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dimension)  # Inner Product (cosine similarity)
+    if len(documents) >= 10_000 and dimension % 48 == 0:
+        # Corpus grande: IVF + PQ de 4 bits con FastScan (igual que rag_service.py)
+        nlist = max(64, int(4 * math.sqrt(len(documents))))
+        index = faiss.index_factory(dimension, f"IVF{nlist},PQ48x4fs", faiss.METRIC_INNER_PRODUCT)
+    else:
+        # Inner Product (cosine similarity) con vectores cuantizados a int8
+        index = faiss.IndexScalarQuantizer(
+            dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+        )
     
-    # Normalizar embeddings para similitud coseno
-    faiss.normalize_L2(embeddings)
+    index.train(embeddings)
     index.add(embeddings)
     
-    # Guardar índice
-    faiss.write_index(index, str(index_path))
+    # Guardar índice: archivo temporal + os.replace, los workers en marcha tienen mapeado el anterior
+    tmp_index_path = index_path.with_name(f"{index_path.name}.tmp.{os.getpid()}")
+    faiss.write_index(index, str(tmp_index_path))
+    os.replace(tmp_index_path, index_path)
     
     print(f"\n✅ Índice FAISS regenerado exitosamente")
     print(f"   - Documentos indexados: {index.ntotal}")
     print(f"   - Dimensión: {dimension}")
     print(f"   - Archivo: {index_path}")
+    print("   ⚠️ Reinicia los workers del servidor para que carguen el nuevo índice")
     
     # Prueba de búsqueda para CONV-018
     print("\n🔍 Probando búsqueda de 'profesional universidad particular'...")
     query = "¿Cuánto cuesta convalidar un curso si soy de modalidad Profesional y el curso viene de una Universidad Particular?"
     query_embedding = model.encode([query])
     faiss.normalize_L2(query_embedding)
+    if hasattr(index, 'nprobe'):
+        index.nprobe = 16
     scores, indices = index.search(query_embedding, 15)
     
     print("\n📊 Top 15 resultados por similitud semántica:")
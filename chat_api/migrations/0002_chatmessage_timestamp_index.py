@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-15 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['-timestamp'], name='chatmessage_timestamp_idx'),
+        ),
+    ]
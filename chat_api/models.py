@@ -8,6 +8,9 @@ class ChatMessage(models.Model):
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['-timestamp'], name='chatmessage_timestamp_idx'),
+        ]
     
     def __str__(self):
         return f"Q: {self.question[:50]}..."
@@ -3,16 +3,778 @@ import os
 import faiss
 import re
 import unicodedata
-import socket
 import time
 import logging
+import hashlib
+import functools
+import gc
+import math
+import threading
+import queue
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
+import torch
+from concurrent.futures import Future
 from sentence_transformers import SentenceTransformer
-from collections import defaultdict
+from collections import OrderedDict, deque
 from django.conf import settings
 
+try:
+    import ahocorasick
+except ImportError:  # pyahocorasick es opcional; sin él se usa str.count
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:  # orjson es opcional; sin él se usa el módulo json estándar
+    orjson = None
+
 logger = logging.getLogger(__name__)
 
+# Hilos para el encoder (torch) y para la búsqueda (FAISS/OpenMP): la mitad de los
+# núcleos para cada uno, así no compiten cuando hay consultas concurrentes
+INFERENCE_THREADS = max(1, (os.cpu_count() or 2) // 2)
+
+EMBEDDING_MODEL = 'paraphrase-multilingual-mpnet-base-v2'
+
+# Máximo de embeddings de consultas guardados en memoria (LRU)
+EMBEDDING_CACHE_SIZE = 10_000
+
+# Ventana para agrupar consultas concurrentes en un solo `encode` (0 desactiva la agrupación).
+# Solo se espera si ya hay otras consultas en cola: una consulta sola se codifica al instante
+EMBEDDING_BATCH_WINDOW = float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', '20')) / 1000
+EMBEDDING_BATCH_SIZE = 32
+
+# Sinónimos del dominio AMPLIADOS
+SYNONYMS = {
+    'matricula': ['matricula', 'inscripcion', 'registro'],
+    'convalidacion': ['convalidacion', 'validacion', 'reconocimiento'],
+    'excepcion': ['excepcion', 'especial', 'extraordinaria'],
+    'requisitos': ['requisitos', 'documentos', 'expediente'],
+    'cronograma': ['cronograma', 'fecha', 'fechas', 'calendario', 'plazo', 'cuando', 'cuanto'],
+    'reserva': ['reserva', 'suspension', 'pausa'],
+    'reactualizacion': ['reactualizacion', 'reactivacion', 'renovacion'],
+    'presentar': ['presentar', 'entregar', 'donde', 'lugar'],
+    'expediente': ['expediente', 'tramite', 'solicitud', 'documento'],
+    'criterios': ['criterios', 'requisitos', 'condiciones', 'exigencias'],
+    'academicos': ['academicos', 'academicas', 'educativos', 'curriculares'],
+    'creditaje': ['creditaje', 'creditos', 'credito', 'unidades'],
+    'contenidos': ['contenidos', 'contenido', 'temas', 'silabo', 'programa'],
+    'similitud': ['similitud', 'equivalencia', 'parecido', 'semejanza'],
+    'institutos': ['institutos', 'instituto', 'cetpro', 'senati', 'sencico'],
+    'restricciones': ['restricciones', 'limitaciones', 'prohibiciones', 'no se puede', 'no se permite'],
+    'pueden': ['pueden', 'puede', 'se puede', 'es posible', 'permiten'],
+    'costo': ['costo', 'precio', 'pago', 'tasa', 'tarifa', 'cuanto cuesta', 'cuanto es', 'valor', 'monto'],
+    'modalidad': ['modalidad', 'tipo', 'categoria', 'ordinario', 'profesional', 'ceprunsa', 'traslado'],
+    'validar': ['validar', 'validacion', 'confirmar', 'confirmacion'],
+    'obligatorio': ['obligatorio', 'obligatoriamente', 'debe', 'requerido', 'necesario'],
+    'finalizar': ['finalizar', 'terminar', 'culminar', 'concluir', 'completar'],
+    'constancia': ['constancia', 'documento', 'comprobante', 'certificado'],
+    'imprimir': ['imprimir', 'descargar', 'obtener'],
+    'acto': ['acto', 'accion', 'procedimiento', 'proceso', 'tramite'],
+    'formal': ['formal', 'oficial', 'administrativo'],
+    'acredita': ['acredita', 'certifica', 'avala', 'valida', 'reconoce'],
+    'condicion': ['condicion', 'estado', 'situacion', 'calidad'],
+    'definicion': ['que es', 'cual es', 'define', 'definicion', 'concepto', 'significa'],
+    'ocurre': ['ocurre', 'pasa', 'sucede', 'acontece', 'resulta'],
+    'dejan': ['dejan', 'abandonan', 'no se matriculan', 'no matricularse', 'dejar de'],
+    'pierden': ['pierden', 'perder', 'perdida', 'perderse'],
+    'postular': ['postular', 'volver a postular', 'postulacion', 'admision'],
+    'adicionales': ['adicionales', 'extras', 'extra', 'mas', 'de mas'],
+    'otorga': ['otorga', 'da', 'concede', 'permite', 'autoriza'],
+    'pendiente': ['pendiente', 'sin aprobar', 'reprobado', 'desaprobado'],
+    'contactar': ['contactar', 'comunicarse', 'escribir', 'enviar mensaje'],
+    'correo': ['correo', 'email', 'correo electronico', 'direccion electronica'],
+    'talleres': ['talleres', 'taller', 'extracurriculares', 'extracurricular', 'actividades complementarias'],
+    'inscribirse': ['inscribirse', 'inscripcion', 'registrarse', 'registro', 'matricularse'],
+    # ✅ NUEVOS SINÓNIMOS PARA MATRÍCULA POR EXCEPCIÓN
+    'egresar': ['egresar', 'culminar', 'terminar', 'finalizar carrera'],
+    'paralelo': ['paralelo', 'simultaneo', 'al mismo tiempo', 'juntas', 'juntos'],
+    'faltan': ['faltan', 'me faltan', 'solo me faltan', 'quedan']
+}
+
+# Palabra -> todas las palabras de los grupos de sinónimos que la contienen
+SYNONYM_EXPANSIONS = {}
+for _syn_list in SYNONYMS.values():
+    for _term in _syn_list:
+        SYNONYM_EXPANSIONS.setdefault(_term, set()).update(_syn_list)
+del _syn_list, _term
+
+# Términos que identifican el tipo de pregunta (sobre la consulta normalizada)
+QUESTION_TERMS = {
+    'date': ('cuando', 'fecha', 'fechas', 'plazo', 'cronograma'),
+    'place': ('donde', 'lugar', 'presentar', 'entregar'),
+    'academic': ('criterios', 'requisitos', 'academico', 'creditaje', 'contenido', 'similitud'),
+    'restriction': (
+        'se pueden', 'se puede', 'puedo', 'permiten', 'permite', 'instituto',
+        'restriccion', 'prohibido', 'no se'
+    ),
+    'cost': (
+        'cuanto', 'cuesta', 'costo', 'precio', 'pago', 'tasa', 'tarifa', 'valor',
+        'monto', 's/'
+    ),
+    'validation': (
+        'validar', 'validacion', 'finalizar', 'terminar', 'culminar', 'obligatorio',
+        'obligatoriamente', 'debe', 'despues de registrar', 'al finalizar',
+        'al terminar', 'constancia'
+    ),
+    'definition': (
+        'que es', 'cual es', 'que significa', 'define', 'definicion', 'concepto',
+        'se considera', 'se entiende por', 'acto formal', 'acto voluntario',
+        'acredita la condicion'
+    ),
+    'payment_procedure': (
+        'varios recibos', 'un solo recibo', 'un recibo', 'varios pagos', 'puedo pagar',
+        'como pago', 'forma de pago', 'procedimiento de pago', 'en cuotas', 'en partes',
+        'fraccionado'
+    ),
+    'amount': (
+        'cuanto cuesta', 'cuanto es', 'cual es el costo', 'cual es el precio', 'monto',
+        'valor', 's/', 'soles'
+    ),
+    'consequence': (
+        'que ocurre', 'que pasa', 'que sucede', 'dejan de matricularse',
+        'no se matriculan', 'no matricularse', 'mas de tres', 'mas de 3',
+        'despues de tres', 'luego de tres', 'pierden', 'perder la condicion',
+        'volver a postular'
+    ),
+    'credits': (
+        'creditos adicionales', 'creditos extra', 'creditos de mas',
+        'cuantos creditos adicionales', 'cuantos creditos extras',
+        'cuantos creditos mas', 'creditos adicionales me otorga',
+        'sin cursos pendientes', 'no tengo cursos pendientes', 'ningun curso pendiente',
+        'sin ningún curso pendiente'
+    ),
+    'contact': (
+        'que correo', 'cual es el correo', 'correo electronico', 'a que correo',
+        'donde contactar', 'como contactar', 'talleres extracurriculares', 'talleres',
+        'inscribirme en talleres', 'oficina de', 'upacdr'
+    ),
+    'exception_enrollment': (
+        'matricula por excepcion', 'por excepcion', 'excepcionalmente',
+        'faltan dos asignaturas', 'dos asignaturas para egresar',
+        'una es prerrequisito', 'llevarlas juntas', 'llevar en paralelo',
+        'llevar las dos'
+    ),
+    'authority': (
+        'quien establece', 'quien programa', 'quien define', 'quien aprueba',
+        'quien determina', 'que entidad', 'que organo', 'consejo universitario',
+        'decano', 'director', 'vicerrectorado'
+    ),
+    'equivalence': (
+        'equivalente', 'equivale', 'es equivalente a', 'abandono es equivalente',
+        'condicion de abandono', 'conteo de matriculas', 'matriculas ejecutadas'
+    ),
+    'payment_place': ('pagar', 'pago', 'derechos', 'tasa'),
+    'submission_place': ('presentar', 'entregar', 'expediente', 'solicitud', 'tramite'),
+}
+
+# Términos de la consulta (sin normalizar, solo minúsculas) que ajustan los pesos de la búsqueda híbrida
+QUERY_WEIGHT_TERMS = {
+    'date': ('cuando', 'fecha', 'fechas', 'plazo', 'cronograma'),
+    'place': ('donde', 'lugar', 'presentar', 'entregar'),
+    'restriction': (
+        'se pueden', 'se puede', 'puedo', 'permiten', 'permite', 'instituto',
+        'restriccion', 'prohibido'
+    ),
+    'cost': (
+        'cuanto', 'cuesta', 'costo', 'precio', 'pago', 'tasa', 'tarifa', 'valor',
+        'monto', 's/'
+    ),
+    'validation': (
+        'validar', 'validacion', 'finalizar', 'terminar', 'obligatorio',
+        'obligatoriamente', 'constancia', 'al finalizar'
+    ),
+    'definition': (
+        'que es', 'cual es', 'que significa', 'define', 'definicion', 'concepto',
+        'acto formal', 'acredita la condicion'
+    ),
+    'consequence': (
+        'que ocurre', 'que pasa', 'que sucede', 'dejan de matricularse', 'mas de tres',
+        'pierden'
+    ),
+    'credits': (
+        'creditos adicionales', 'creditos extra', 'cuantos creditos',
+        'sin cursos pendientes', 'ningun curso pendiente'
+    ),
+    'contact': (
+        'que correo', 'cual es el correo', 'correo electronico',
+        'talleres extracurriculares', 'talleres', 'contactar', 'inscribirme'
+    ),
+    'exception_enrollment': (
+        'matricula por excepcion', 'por excepcion', 'faltan dos asignaturas',
+        'llevarlas juntas', 'llevar en paralelo'
+    ),
+    'authority': (
+        'quien establece', 'quien programa', 'quien define', 'consejo universitario',
+        'que entidad', 'que organo'
+    ),
+    'equivalence': (
+        'equivalente', 'equivale', 'es equivalente a', 'abandono es equivalente',
+        'conteo de matriculas'
+    ),
+    'payment_place': ('pagar', 'pago', 'caja', 'derechos', 'tasa'),
+    'submission_place': ('presentar', 'entregar', 'expediente', 'tramite'),
+}
+
+# Palabras clave que se buscan en cada documento según el tipo de pregunta
+DOCUMENT_KEYWORDS = {
+    'authority': (
+        'consejo universitario', 'establecera', 'establece', 'calendario academico',
+        'programa las fechas', 'programara', 'articulo 11', 'anualmente'
+    ),
+    'equivalence': (
+        'abandono', 'equivalente', 'desaprobacion', 'conteo de matriculas',
+        'matriculas ejecutadas', 'calificacion final', 'disposicion final', 'primera'
+    ),
+    'exception_enrollment': (
+        'matricula por excepcion', 'excepcion', 'dos (2) asignaturas',
+        'dos asignaturas', 'para egresar', 'egresar', 'prerrequisito', 'en paralelo',
+        'llevar las dos', 'simultaneamente'
+    ),
+    'contact': (
+        'talleres extracurriculares', 'taller', 'correo', 'upacdr',
+        'oficina de promocion', 'arte, cultura, deporte', 'contactar', 'inscripcion',
+        '@unsa.edu.pe'
+    ),
+    'credits': (
+        'seis (6) creditos adicionales', 'seis (06) creditos adicionales',
+        '6 creditos adicionales', '06 creditos adicionales', 'creditos adicionales',
+        'sin cursos pendientes', 'ningun curso pendiente', 'no tengan ningun curso',
+        'sistema considera automaticamente'
+    ),
+    'consequence': (
+        'perderan', 'pierden', 'perder', 'perdida', 'condicion de estudiante',
+        'condicion', 'postular nuevamente', 'volver a postular', 'postulacion',
+        'mas de tres', 'mas de 3 anos', 'tres anos', 'consecutivos o alternos',
+        'consecutivos', 'alternos'
+    ),
+    'definition': (
+        'es el acto', 'se considera', 'se define', 'definicion', 'acto formal',
+        'acto voluntario', 'acredita', 'condicion de estudiante', 'articulo 3',
+        'articulo 4', 'articulo'
+    ),
+    'validation': (
+        'validar', 'validacion', 'validar su matricula', 'obligatorio', 'obligado',
+        'debe', 'constancia', 'imprimir', 'finalizar', 'finalmente'
+    ),
+    'payment_procedure': (
+        'recibo', 'recibos', 'un solo', 'todas las asignaturas', 'monto total', 'pago'
+    ),
+    'restriction': (
+        'no se convalidan', 'restriccion', 'prohibido', 'no se permite', 'instituto',
+        'institutos', 'obligatorio'
+    ),
+    'academic': ('creditaje', 'creditos', 'similitud', '80%', 'contenido', 'igual', 'mayor'),
+    'place': ('escuela', 'oficina', 'caja', 'lugar', 'presentar', 'entregar'),
+    'negation': (
+        'no se convalidan', 'no se puede', 'no se permite', 'prohibido', 'es obligatorio'
+    ),
+}
+
+# Cualquier fecha en el documento (una sola pasada con alternancia)
+DATE_BONUS_RE = re.compile(
+    r'\d{1,2}\s+de\s+\w+|del\s+\d{1,2}\s+al\s+\d{1,2}|\d{1,2}\s*[-/]\s*\d{1,2}'
+)
+
+# Fechas en las respuestas del LLM y en el contexto (validación de fechas inventadas)
+DAY_MONTH_RE = re.compile(r'(\d{1,2})\s+de\s+(\w+)')
+RESPONSE_RANGE_RE = re.compile(r'del\s+(\d{1,2})\s+al\s+(\d{1,2})')
+CONTEXT_RANGE_RE = re.compile(r'(\d{1,2})\s+al\s+(\d{1,2})')
+
+# Limpieza de respuestas: (patrón, reemplazo) en orden de aplicación
+THINK_TAG_RE = re.compile(r'<think>.*?</think>', re.DOTALL)
+THINK_OPEN, THINK_CLOSE = '<think>', '</think>'
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+RESPONSE_CLEANUP_PATTERNS = (
+    # Referencias a "DOCUMENTO X"
+    (re.compile(r'Según el DOCUMENTO \d+[^,.:]*,?\s*', re.IGNORECASE), ''),
+    (re.compile(r'En el DOCUMENTO \d+[^,.:]*,?\s*', re.IGNORECASE), ''),
+    (re.compile(r'El DOCUMENTO \d+[^,.:]*\s+(indica|dice|menciona|establece)\s+que\s*', re.IGNORECASE), ''),
+    # Códigos entre corchetes
+    (re.compile(r'\[CONV-[A-Z0-9-]+\]'), ''),
+    (re.compile(r'\[MAT-[A-Z0-9-]+\]'), ''),
+    (re.compile(r'\[RES-[A-Z0-9-]+\]'), ''),
+    # Frases como "según el contexto proporcionado"
+    (re.compile(r'Según el contexto proporcionado,?\s*', re.IGNORECASE), ''),
+    (re.compile(r'Basándome en la información proporcionada,?\s*', re.IGNORECASE), ''),
+    (re.compile(r'De acuerdo (al|con el) contexto,?\s*', re.IGNORECASE), ''),
+    # Espacios múltiples
+    (re.compile(r'\s+'), ' '),
+)
+
+# Caché semántica (LSH por proyecciones aleatorias) de candidatos FAISS
+SEMANTIC_CACHE_SIZE = 1024
+# Entradas por cubeta LSH: las más antiguas salen primero, el recorrido lineal queda acotado
+SEMANTIC_CACHE_BUCKET_SIZE = 8
+SEMANTIC_CACHE_THRESHOLD = 0.97
+LSH_BITS = 16
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# Sesión HTTP del proceso para Ollama (generación, streaming y warmup): reutiliza las conexiones TCP entre consultas.
+# Sin reintentos del adaptador: los reintentos los decide _generate_with_ollama
+_OLLAMA = requests.Session()
+_OLLAMA.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=0))
+_OLLAMA.headers['Connection'] = 'keep-alive'
+
+# -1: el modelo queda cargado en Ollama indefinidamente (sin recargas entre consultas espaciadas)
+OLLAMA_KEEP_ALIVE = -1
+# Ventana de contexto (instrucciones + 5 documentos + respuesta) y tamaño de lote del prefill
+OLLAMA_NUM_CTX = 4096
+OLLAMA_NUM_BATCH = 512
+# Opciones del runner: si una petición pide otras distintas a las del modelo cargado, Ollama lo recarga.
+# El warmup y todas las generaciones envían las mismas
+OLLAMA_RUNNER_OPTIONS = {"num_ctx": OLLAMA_NUM_CTX, "num_batch": OLLAMA_NUM_BATCH}
+
+# Instrucciones fijas del asistente: van como mensaje "system" de /api/chat para que el
+# prefijo del prompt sea idéntico entre consultas y se reutilice su caché KV
+SYSTEM_PROMPT = """Eres un asistente especializado en normativas académicas de la Universidad Nacional de San Agustín (UNSA).
+
+INSTRUCCIONES CRÍTICAS:
+
+1. **LEE CUIDADOSAMENTE** cada documento del contexto - están numerados (DOCUMENTO 1, DOCUMENTO 2, etc.)
+
+2. **EXTRAE INFORMACIÓN ESPECÍFICA** según la pregunta:
+   - Si preguntan "DÓNDE": Busca en "📍 Lugar" o en el contenido principal
+   - Si preguntan "CUÁNDO/FECHAS": Busca en "📅 FECHAS" 
+   - Si preguntan "CUÁNTO/COSTO": Busca en "💰 Costo"
+
+3. **NO MEZCLES INFORMACIÓN** de diferentes documentos:
+   - Un documento sobre "Presentación de expedientes" NO es lo mismo que "Pago"
+   - Un documento sobre "Lugar de pago" NO es el lugar de presentación del expediente
+
+4. **PRIORIZA** el documento más relevante,el DOCUMENTO 1 es el MÁS RELEVANTE para esta pregunta.
+   - Si el DOCUMENTO 1 contiene la respuesta completa, ÚSALO y NO mezcles con otros documentos.
+   - Solo usa otros documentos si el DOCUMENTO 1 no tiene información suficiente.
+
+5. **FORMATO DE RESPUESTA**:
+   - Responde de forma directa y estructurada
+   - Si hay fechas, escríbelas como: "Del **17 de marzo** al **28 de marzo**"
+   - Si hay lugares, especifica claramente: "en [lugar exacto]"
+   - Si hay costos, menciónalos: "S/ [monto]"
+   - Brinda la información sin mencionar los documentos de donde la extraiste.
+
+6. **PROHIBIDO**:
+   - Inventar información que no esté en el contexto
+   - Mezclar información de documentos diferentes
+   - Usar plantillas como "[día] de [mes]"
+
+7. Si NO encuentras información específica en el contexto, di: "No encontré información sobre [tema específico]"
+"""
+
+# Al reintentar por fechas inventadas la advertencia va en el mensaje del usuario: el de sistema no cambia
+RETRY_WARNING = (
+    "⚠️ ADVERTENCIA: Tu respuesta anterior contenía fechas incorrectas. "
+    "Usa únicamente las fechas que aparecen en el contexto.\n\n"
+)
+
+# Formato del contexto enviado al LLM; el contenido de cada documento se recorta a MAX_CTX_CHARS
+DOCUMENT_RULE = "-" * 50
+CONTEXT_HEADER = "\n\n" + "=" * 70 + "\n\n"
+CONTEXT_FOOTER = "\n\n" + "=" * 70
+MAX_CTX_CHARS = 2000
+# Documentos con puntuación combinada menor no entran al contexto (el primero siempre entra)
+MIN_CONTEXT_SCORE = 0.3
+# Presupuesto del contexto en palabras (conteo rápido por espacios) para no exceder OLLAMA_NUM_CTX
+MAX_CTX_TOKENS = 1200
+
+NO_RESULTS_ANSWER = "No encontré información relevante para tu consulta. Por favor, reformula tu pregunta."
+ERROR_ANSWER = "Lo siento, no puedo procesar tu consulta en este momento. Por favor, intenta más tarde."
+
+# Caché de respuestas por (pregunta normalizada, documentos recuperados)
+ANSWER_CACHE_SIZE = 1024
+ANSWER_CACHE_TTL = 3600
+
+# Índice IVF-PQ (FastScan de 4 bits) solo a partir de este tamaño de corpus;
+# por debajo, el índice plano cuantizado a int8 es más rápido y exacto
+IVFPQ_MIN_DOCUMENTS = 10_000
+IVFPQ_M = 48
+IVF_NPROBE = 16
+
+
+# Vocales acentuadas y eñe -> ASCII; cubre casi todo el texto del dataset sin pasar por NFD
+ACCENT_TRANSLATION = str.maketrans(
+    "áéíóúüñÁÉÍÓÚÜÑàèìòùÀÈÌÒÙâêîôûÂÊÎÔÛäëïöÄËÏÖçÇ",
+    "aeiouunAEIOUUNaeiouAEIOUaeiouAEIOUaeioAEIOcC"
+)
+COMBINING_MARKS_RE = re.compile('[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]')
+
+
+def _normalize_text(text):
+    """Minúsculas y sin tildes (sin caché, para contextos y respuestas únicos)"""
+    text = text.translate(ACCENT_TRANSLATION)
+    if not text.isascii():
+        # Caracteres no cubiertos por la tabla: descomponer y quitar las marcas diacríticas
+        text = COMBINING_MARKS_RE.sub('', unicodedata.normalize('NFD', text))
+    return text.casefold()
+
+
+# Solo para textos cortos y repetidos (campos de documentos, consultas)
+_normalize = functools.lru_cache(maxsize=4096)(_normalize_text)
+
+
+def _matched_keywords(text, category):
+    """Palabras clave de DOCUMENT_KEYWORDS[category] presentes en el texto (una sola pasada)"""
+    automaton = DOCUMENT_KEYWORD_AUTOMATA.get(category)
+    if automaton is None:
+        return {kw for kw in DOCUMENT_KEYWORDS[category] if kw in text}
+    return {kw for _, kw in automaton.iter(text)}
+
+
+def _normalize_fields(documents):
+    """Textos normalizados de cada documento: contenido y metadatos usados en el ranking"""
+    return {
+        'content': [_normalize(doc['content']) for doc in documents],
+        'sub_categoria': [_normalize(doc.get('sub_categoria') or '') for doc in documents],
+        'modalidad_pago_relacionada': [
+            _normalize(doc.get('modalidad_pago_relacionada') or '') for doc in documents
+        ],
+        'categoria_principal': [_normalize(doc.get('categoria_principal') or '') for doc in documents],
+    }
+
+
+# Bits de modalidad y procedencia de `modalidad_pago_relacionada` (preguntas de monto)
+MODALIDAD_BITS = {'ordinario': 1, 'profesionales': 2, 'ceprunsa': 4, 'traslado': 8}
+PROCEDENCIA_BITS = {'otra_escuela_unsa': 1, 'universidad_nacional_otra': 2, 'universidad_particular': 4}
+
+
+def _modalidad_flags(modalidad_normalized):
+    """Máscara de modalidades mencionadas en la modalidad de pago (normalizada) de un documento"""
+    flags = 0
+    for modalidad, bit in MODALIDAD_BITS.items():
+        if modalidad in modalidad_normalized:
+            flags |= bit
+    return flags
+
+
+def _procedencia_flags(modalidad_normalized):
+    """Máscara de procedencias mencionadas en la modalidad de pago (normalizada) de un documento"""
+    flags = 0
+    if 'otra escuela de la unsa' in modalidad_normalized or 'escuela de la unsa' in modalidad_normalized:
+        flags |= PROCEDENCIA_BITS['otra_escuela_unsa']
+    if 'universidad nacional' in modalidad_normalized and 'otra' in modalidad_normalized:
+        flags |= PROCEDENCIA_BITS['universidad_nacional_otra']
+    if 'universidad particular' in modalidad_normalized:
+        flags |= PROCEDENCIA_BITS['universidad_particular']
+    return flags
+
+
+def _document_features(documents, normalized):
+    """Rasgos de cada documento que no dependen de la consulta, como arreglos de NumPy"""
+    contents = normalized['content']
+    sub_categorias = normalized['sub_categoria']
+    modalidades = normalized['modalidad_pago_relacionada']
+    return {
+        # Número de palabras clave distintas de cada categoría presentes en el contenido
+        'keyword_counts': {
+            category: np.array(
+                [len(_matched_keywords(content, category)) for content in contents], dtype=np.int64
+            )
+            for category in DOCUMENT_KEYWORDS
+        },
+        'date_pattern': np.array([bool(DATE_BONUS_RE.search(c)) for c in contents], dtype=bool),
+        'fecha_relevante': np.array([bool(doc.get('fecha_relevante')) for doc in documents], dtype=bool),
+        'actividad_cronograma': np.array(
+            [bool(doc.get('actividad_cronograma')) for doc in documents], dtype=bool
+        ),
+        'lugar_pago': np.array([bool(doc.get('lugar_pago')) for doc in documents], dtype=bool),
+        'restriction_sub_categoria': np.array(
+            ['restriccion' in sc or 'limitacion' in sc for sc in sub_categorias], dtype=bool
+        ),
+        'academic_sub_categoria': np.array(['academico' in sc for sc in sub_categorias], dtype=bool),
+        # Filtros de las preguntas de monto
+        'tasa_soles': np.array([bool(doc.get('tasa_soles')) for doc in documents], dtype=bool),
+        'modalidad': np.array([bool(m) for m in modalidades], dtype=bool),
+        'modalidad_flags': np.array([_modalidad_flags(m) for m in modalidades], dtype=np.uint8),
+        'procedencia_flags': np.array([_procedencia_flags(m) for m in modalidades], dtype=np.uint8),
+    }
+
+
+def _fuse_scores(semantic, keyword, weights, top_k):
+    """Puntuación combinada y posiciones de las top_k mejores, de mayor a menor.
+
+    En empate se conserva el orden de entrada (el semántico), igual que un sort estable.
+    """
+    combined = semantic * weights[0] + keyword * weights[1]
+    candidates = np.arange(len(combined))
+    if len(combined) > top_k:
+        # Selección parcial: solo se ordenan las que alcanzan la k-ésima puntuación
+        kth_score = -np.partition(-combined, top_k - 1)[top_k - 1]
+        candidates = np.flatnonzero(combined >= kth_score)
+    order = candidates[np.argsort(-combined[candidates], kind='stable')][:top_k]
+    return combined, order
+
+
+def _render_context_doc(idx, doc):
+    """Bloque de un documento en el contexto del LLM: encabezado, metadata y contenido"""
+    header = f"DOCUMENTO {idx}"
+    if doc.get('id_chunk'):
+        header += f" [{doc['id_chunk']}]"
+    if doc.get('categoria_principal'):
+        header += f" - {doc['categoria_principal']}"
+    if doc.get('sub_categoria'):
+        header += f" > {doc['sub_categoria']}"
+    
+    # METADATA estructurada (seguida de una línea en blanco si hay alguna)
+    actividad = doc.get('actividad_cronograma')
+    fecha = doc.get('fecha_relevante')
+    lugar = doc.get('lugar_pago')
+    tasa = doc.get('tasa_soles')
+    metadata = (
+        (f"📌 Actividad: {actividad}\n" if actividad else "")
+        + (f"📅 FECHAS: {fecha}\n" if fecha else "")
+        + (f"📍 Lugar de pago: {lugar}\n" if lugar else "")
+        + (f"💰 Costo: S/ {tasa}\n" if tasa else "")
+    )
+    if metadata:
+        metadata += "\n"
+    
+    return f"{header}\n{DOCUMENT_RULE}\n{metadata}📄 Información: {doc['content'][:MAX_CTX_CHARS]}"
+
+
+def _canonical_dates(text_normalized, range_re):
+    """Fechas del texto en forma canónica ('2 de abril', '20 al 24'): sin ceros a la izquierda ni espacios extra"""
+    dates = {f"{int(day)} de {month}" for day, month in DAY_MONTH_RE.findall(text_normalized)}
+    dates.update(f"{int(start)} al {int(end)}" for start, end in range_re.findall(text_normalized))
+    return dates
+
+
+def _json_dumps(payload):
+    """Serializar a bytes JSON (orjson si está instalado)"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+def _json_loads(data):
+    """Deserializar JSON (orjson si está instalado)"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _partial_tag_len(text, tag):
+    """Longitud del sufijo de text que es el comienzo de tag (etiqueta partida entre fragmentos)"""
+    for size in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:size]):
+            return size
+    return 0
+
+
+def _strip_think_tags(chunks):
+    """Quitar los bloques <think>...</think> de un stream de fragmentos a medida que llegan"""
+    buffer = ''
+    thinking = False
+    for chunk in chunks:
+        buffer += chunk
+        while buffer:
+            if thinking:
+                end = buffer.find(THINK_CLOSE)
+                if end < 0:
+                    # Se conserva solo lo que podría ser el inicio de la etiqueta de cierre
+                    buffer = buffer[len(buffer) - _partial_tag_len(buffer, THINK_CLOSE):]
+                    break
+                buffer = buffer[end + len(THINK_CLOSE):]
+                thinking = False
+            else:
+                start = buffer.find(THINK_OPEN)
+                if start >= 0:
+                    if start:
+                        yield buffer[:start]
+                    buffer = buffer[start + len(THINK_OPEN):]
+                    thinking = True
+                    continue
+                keep = _partial_tag_len(buffer, THINK_OPEN)
+                if len(buffer) > keep:
+                    yield buffer[:len(buffer) - keep]
+                buffer = buffer[len(buffer) - keep:]
+                break
+    
+    if buffer and not thinking:
+        yield buffer
+
+
+def _write_index_atomic(index, path):
+    """Guardar el índice sin truncar el archivo que los workers en marcha tienen mapeado en memoria"""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _build_automaton(words):
+    """Autómata Aho-Corasick para buscar varias palabras en una sola pasada"""
+    automaton = ahocorasick.Automaton()
+    for word in words:
+        automaton.add_word(word, word)
+    automaton.make_automaton()
+    return automaton
+
+
+@functools.lru_cache(maxsize=1024)
+def _query_automaton(words):
+    """Autómata de las palabras de una consulta (frozenset): las preguntas repetidas lo reutilizan"""
+    return _build_automaton(words)
+
+
+# Un autómata por categoría de palabras clave (si pyahocorasick está instalado)
+DOCUMENT_KEYWORD_AUTOMATA = {}
+if ahocorasick is not None:
+    DOCUMENT_KEYWORD_AUTOMATA = {
+        category: _build_automaton(keywords) for category, keywords in DOCUMENT_KEYWORDS.items()
+    }
+
+
+def _build_category_automaton(terms_by_category):
+    """Autómata Aho-Corasick cuyo valor es la máscara de bits de las categorías de cada término"""
+    masks = {}
+    for bit, terms in enumerate(terms_by_category.values()):
+        for term in terms:
+            masks[term] = masks.get(term, 0) | (1 << bit)
+    automaton = ahocorasick.Automaton()
+    for term, mask in masks.items():
+        automaton.add_word(term, mask)
+    automaton.make_automaton()
+    return automaton
+
+
+def _matched_categories(text, terms_by_category, automaton):
+    """Categorías de `terms_by_category` con algún término presente en el texto (una sola pasada)"""
+    if automaton is None:
+        return {
+            category for category, terms in terms_by_category.items()
+            if any(term in text for term in terms)
+        }
+    mask = 0
+    for _, term_mask in automaton.iter(text):
+        mask |= term_mask
+    return {category for bit, category in enumerate(terms_by_category) if mask >> bit & 1}
+
+
+# Autómatas de detección del tipo de pregunta (si pyahocorasick está instalado)
+QUESTION_TERMS_AUTOMATON = None
+QUERY_WEIGHT_TERMS_AUTOMATON = None
+if ahocorasick is not None:
+    QUESTION_TERMS_AUTOMATON = _build_category_automaton(QUESTION_TERMS)
+    QUERY_WEIGHT_TERMS_AUTOMATON = _build_category_automaton(QUERY_WEIGHT_TERMS)
+
+
+class QueryEmbeddingBatcher:
+    """Agrupa las consultas que llegan dentro de una ventana corta en una sola pasada del encoder"""
+    
+    def __init__(self, model, window=EMBEDDING_BATCH_WINDOW, max_batch=EMBEDDING_BATCH_SIZE):
+        self.model = model
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+    
+    def encode(self, text):
+        """Embedding normalizado (1, dim) en float32 contiguo; bloquea hasta que su lote se procesa"""
+        future = Future()
+        self._queue.put((text, future))
+        return future.result()
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            
+            # Consultas que ya estaban esperando (p. ej. llegadas durante el lote anterior)
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            # La ventana solo se abre cuando las consultas están llegando juntas
+            if len(batch) > 1:
+                deadline = time.monotonic() + self.window
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=remaining))
+                    except queue.Empty:
+                        break
+            
+            try:
+                with torch.inference_mode():
+                    embeddings = np.ascontiguousarray(
+                        self.model.encode(
+                            [text for text, _ in batch],
+                            batch_size=self.max_batch,
+                            normalize_embeddings=True,
+                            convert_to_numpy=True
+                        ),
+                        dtype=np.float32
+                    )
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            
+            if len(batch) > 1:
+                logger.info(f"🧠 Lote de {len(batch)} consultas codificado en una pasada")
+            for i, (_, future) in enumerate(batch):
+                future.set_result(embeddings[i:i + 1])
+
+
+class OnnxSentenceEncoder:
+    """Encoder ONNX cuantizado a INT8 con la misma interfaz `encode` que SentenceTransformer"""
+    
+    def __init__(self, model_id, cache_dir, max_seq_length=128):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+        
+        quantized_file = 'model_quantized.onnx'
+        if not os.path.exists(os.path.join(cache_dir, quantized_file)):
+            # Exportar a ONNX y cuantizar pesos a INT8 (cuantización dinámica)
+            logger.info(f"📦 Exportando {model_id} a ONNX INT8 en {cache_dir}...")
+            model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+            model.save_pretrained(cache_dir)
+            AutoTokenizer.from_pretrained(model_id).save_pretrained(cache_dir)
+            
+            quantizer = ORTQuantizer.from_pretrained(model)
+            qconfig = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+            quantizer.quantize(save_dir=cache_dir, quantization_config=qconfig)
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(cache_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(cache_dir, file_name=quantized_file)
+        self.max_seq_length = max_seq_length
+    
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False,
+               convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        """Mean pooling + normalización L2 opcional, igual que SentenceTransformer"""
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            features = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors='np'
+            )
+            token_embeddings = self.model(**features).last_hidden_state
+            
+            mask = features['attention_mask'][..., None].astype(np.float32)
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            
+            if normalize_embeddings:
+                embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+            
+            batches.append(embeddings.astype(np.float32))
+        
+        embeddings = np.concatenate(batches) if batches else np.empty((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
 class RAGService:
     def __init__(self):
         # Rutas de archivos
@@ -20,265 +782,478 @@ class RAGService:
         self.json_path = os.path.join(self.base_path, 'dataset_v2.json')
         self.index_path = os.path.join(self.base_path, 'index.faiss')
         
+        # Sin recolector de basura durante la carga: el modelo y el índice crean millones de objetos
+        gc.disable()
+        try:
+            self._load()
+        finally:
+            gc.collect()
+            gc.enable()
+        
+        # Consultas concurrentes comparten una sola pasada del encoder
+        self._query_batcher = QueryEmbeddingBatcher(self.model) if EMBEDDING_BATCH_WINDOW > 0 else None
+        
+        # Primera codificación y búsqueda fuera del camino de la primera consulta
+        self._warmup_search()
+        
+        # Cargar el modelo en Ollama en segundo plano para que la primera consulta no pague el arranque en frío
+        threading.Thread(target=self._warmup_ollama, daemon=True).start()
+        
+        logger.info(f"✅ RAG Service iniciado")
+        logger.info(f"   Modelo Ollama: {self.ollama_model}")
+    
+    def _load(self):
+        """Cargar modelo de embeddings, documentos e índice"""
         # Inicializar modelo de embeddings
-        self.model = SentenceTransformer('paraphrase-multilingual-mpnet-base-v2')
+        torch.set_num_threads(INFERENCE_THREADS)
+        self.model = self._load_embedding_model()
+        
+        # Caché LRU de embeddings de consultas (las preguntas se repiten mucho)
+        self._embedding_cache = OrderedDict()
+        self._embedding_cache_lock = threading.Lock()
+        self._embedding_cache_hits = 0
+        self._embedding_cache_misses = 0
         
         # ✅ Configuración LLM (SOLO LOCAL)
         self.ollama_model = os.getenv('OLLAMA_MODEL', 'qwen2.5:14b-instruct')
-        self.ollama_url = "http://localhost:11434/api/generate"
+        self.ollama_url = "http://localhost:11434/api/chat"
         
         # Cargar datos y crear índice
         self.documents = self.load_documents()
+        self._prepare_documents()
+        if isinstance(self.model, SentenceTransformer):
+            self._accelerate_encoder()
         self.index = self.load_or_create_index()
+        faiss.omp_set_num_threads(INFERENCE_THREADS)
+        if self.index is not None and hasattr(faiss, 'StandardGpuResources') and faiss.get_num_gpus() > 0:
+            self.index = self._index_to_gpu(self.index)
         
-        logger.info(f"✅ RAG Service iniciado")
-        logger.info(f"   Modelo Ollama: {self.ollama_model}")
+        # Caché de respuestas: misma pregunta con los mismos documentos no vuelve a llamar a Ollama
+        self._answer_cache = OrderedDict()
+        self._answer_cache_lock = threading.Lock()
+        
+        # Caché semántica: consultas casi idénticas reutilizan los candidatos FAISS
+        self._semantic_cache = OrderedDict()
+        self._semantic_cache_lock = threading.Lock()
+        if self.index is not None:
+            rng = np.random.default_rng(0)
+            self._lsh_planes = rng.standard_normal((LSH_BITS, self.index.d)).astype(np.float32)
+    
+    def _warmup_search(self):
+        """Una codificación y una búsqueda de prueba (tokenizer, kernels y páginas del índice)"""
+        with torch.inference_mode():
+            self.model.encode(["hola"], normalize_embeddings=True)
+        if self.index is not None:
+            self.index.search(np.zeros((1, self.index.d), dtype=np.float32), 5)
+    
+    def _load_embedding_model(self):
+        """SentenceTransformer por defecto; ONNX INT8 con EMBEDDINGS_BACKEND=onnx"""
+        if os.getenv('EMBEDDINGS_BACKEND', 'sentence-transformers') == 'onnx':
+            try:
+                return OnnxSentenceEncoder(
+                    f"sentence-transformers/{EMBEDDING_MODEL}",
+                    os.path.join(self.base_path, 'onnx_encoder')
+                )
+            except ImportError as e:
+                logger.warning(f"⚠️ Backend ONNX no disponible ({e}), usando SentenceTransformer")
+        
+        return SentenceTransformer(EMBEDDING_MODEL)
+    
+    def _accelerate_encoder(self):
+        """BetterTransformer si está disponible; en GPU además FP16 (si no altera los embeddings) y torch.compile.
+
+        En CPU torch.compile se activa con EMBEDDINGS_COMPILE=1.
+        """
+        transformer = self.model[0]
+        try:
+            from optimum.bettertransformer import BetterTransformer
+            transformer.auto_model = BetterTransformer.transform(transformer.auto_model, keep_original_model=False)
+            logger.info("⚡ Encoder con BetterTransformer")
+        except (ImportError, ValueError, NotImplementedError) as e:
+            logger.info(f"BetterTransformer no disponible para el encoder: {e}")
+        
+        if self.model.device.type != 'cuda':
+            if os.getenv('EMBEDDINGS_COMPILE') == '1':
+                self._compile_encoder()
+            return
+        
+        # FP16 solo si los embeddings de una muestra del corpus apenas cambian
+        sample = [doc['content'] for doc in self.documents[:32]]
+        with torch.inference_mode():
+            reference = self.model.encode(sample, normalize_embeddings=True, convert_to_numpy=True)
+            self.model.half()
+            half = self.model.encode(sample, normalize_embeddings=True, convert_to_numpy=True)
+        min_cosine = float(np.min(np.sum(reference * half.astype(np.float32), axis=1))) if sample else 1.0
+        if min_cosine < 0.99:
+            self.model.float()
+            logger.warning(f"⚠️ FP16 altera los embeddings (coseno mínimo {min_cosine:.4f}), se mantiene FP32")
+        else:
+            logger.info(f"⚡ Encoder en FP16 (coseno mínimo {min_cosine:.4f})")
+        
+        self._compile_encoder()
+    
+    def _compile_encoder(self):
+        """torch.compile del transformer; entradas rellenadas a max_seq_length para no recompilar por longitud"""
+        transformer = self.model[0]
+        tokenizer = transformer.tokenizer
+        max_length = transformer.max_seq_length
+        
+        def tokenize(texts, padding=True):
+            return tokenizer(
+                texts, padding='max_length', truncation=True, max_length=max_length, return_tensors='pt'
+            )
+        
+        transformer.tokenize = tokenize
+        transformer.auto_model = torch.compile(transformer.auto_model, mode="reduce-overhead")
+        logger.info(f"⚡ Encoder compilado (entradas de {max_length} tokens)")
     
     def load_documents(self):
         """Cargar documentos desde JSON"""
         try:
-            with open(self.json_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(self.json_path, 'rb') as f:
+                return _json_loads(f.read())
         except FileNotFoundError:
             logger.error(f"Error: No se encontró {self.json_path}")
             return []
     
+    def _prepare_documents(self):
+        """Precalcular el texto normalizado de cada documento (una vez, no por consulta)"""
+        self._normalized = _normalize_fields(self.documents)
+        self._features = _document_features(self.documents, self._normalized)
+        contents_normalized = self._normalized['content']
+        
+        # Matriz término-documento con los conteos de todo el vocabulario de sinónimos:
+        # el puntaje por palabras de una consulta se vuelve una suma de columnas
+        vocabulary = sorted({term for syn_list in SYNONYMS.values() for term in syn_list})
+        self._vocabulary = {term: j for j, term in enumerate(vocabulary)}
+        self._term_counts = np.array(
+            [[content.count(term) for term in vocabulary] for content in contents_normalized],
+            dtype=np.int32
+        ).reshape(len(contents_normalized), len(vocabulary))
+    
     def load_or_create_index(self):
         """Cargar índice existente o crear uno nuevo"""
         if os.path.exists(self.index_path):
-            return faiss.read_index(self.index_path)
+            io_flags = self._index_io_flags()
+            try:
+                index = faiss.read_index(self.index_path, io_flags)
+            except RuntimeError:
+                if io_flags == faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY:
+                    raise
+                logger.warning("⚠️ El índice no admite IO_FLAG_MMAP_IFC, se carga con IO_FLAG_MMAP")
+                index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
         else:
-            return self.create_index()
+            index = self.create_index()
+        
+        # Listas invertidas a revisar por consulta (solo índices IVF)
+        if index is not None and hasattr(index, 'nprobe'):
+            index.nprobe = IVF_NPROBE
+        
+        return index
+    
+    def _index_io_flags(self):
+        """Flags de lectura para mapear el índice en memoria (compartido entre workers vía page cache)"""
+        # El tipo se toma del archivo (fourcc de la cabecera), no del dataset: ambos pueden no coincidir
+        with open(self.index_path, 'rb') as f:
+            fourcc = f.read(4)
+        
+        # IO_FLAG_MMAP solo mapea las listas invertidas IVF ('Iw..'/'Iv..'); los índices planos/SQ necesitan MMAP_IFC (faiss >= 1.8)
+        if fourcc[:2] not in (b'Iw', b'Iv') and hasattr(faiss, 'IO_FLAG_MMAP_IFC'):
+            return faiss.IO_FLAG_MMAP_IFC
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    
+    def _index_to_gpu(self, index):
+        """Mover el índice a la GPU con vectores en FP16 (si el tipo de índice lo permite)"""
+        try:
+            self._gpu_resources = faiss.StandardGpuResources()
+            options = faiss.GpuClonerOptions()
+            options.useFloat16 = True
+            gpu_index = faiss.index_cpu_to_gpu(self._gpu_resources, 0, index, options)
+            logger.info("🚀 Índice FAISS cargado en GPU (FP16)")
+            return gpu_index
+        except RuntimeError as e:
+            logger.warning(f"⚠️ El índice no se puede usar en GPU, se mantiene en CPU: {e}")
+            return index
     
     def create_index(self):
         """Crear índice FAISS"""
         if not self.documents:
             return None
         
-        # Crear embeddings
+        # Crear embeddings normalizados (para similitud coseno) en lotes
         texts = [doc['content'] for doc in self.documents]
-        embeddings = self.model.encode(texts)
+        with torch.inference_mode():
+            embeddings = self.model.encode(
+                texts,
+                batch_size=64,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=True
+            )
         
         # Crear índice FAISS
         dimension = embeddings.shape[1]
-        index = faiss.IndexFlatIP(dimension)
+        if len(embeddings) >= IVFPQ_MIN_DOCUMENTS and dimension % IVFPQ_M == 0:
+            # Corpus grande: IVF + PQ de 4 bits con FastScan (LUT en registros SIMD)
+            nlist = max(64, int(4 * math.sqrt(len(embeddings))))
+            index = faiss.index_factory(
+                dimension, f"IVF{nlist},PQ{IVFPQ_M}x4fs", faiss.METRIC_INNER_PRODUCT
+            )
+        else:
+            # Corpus pequeño: búsqueda exhaustiva con vectores cuantizados a int8
+            index = faiss.IndexScalarQuantizer(
+                dimension, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT
+            )
         
-        # Normalizar embeddings para similitud coseno
-        faiss.normalize_L2(embeddings)
+        index.train(embeddings)
         index.add(embeddings)
         
         # Guardar índice
         os.makedirs(self.base_path, exist_ok=True)
-        faiss.write_index(index, self.index_path)
+        _write_index_atomic(index, self.index_path)
         
         return index
     
-    def keyword_search(self, query, documents):
-        """Búsqueda por palabras clave mejorada con sinónimos"""
+    def _encode_query(self, query):
+        """Embedding normalizado de la consulta, reutilizando la caché LRU"""
+        # Espacios extra no cambian la pregunta: misma entrada de caché y mismo embedding
+        query = ' '.join(query.split())
+        key = hashlib.blake2b(query.encode('utf-8'), digest_size=16).digest()
+        
+        with self._embedding_cache_lock:
+            embedding = self._embedding_cache.get(key)
+            if embedding is not None:
+                self._embedding_cache.move_to_end(key)
+                self._embedding_cache_hits += 1
+        
+        if embedding is None:
+            if self._query_batcher is not None:
+                embedding = self._query_batcher.encode(query)
+            else:
+                # FAISS espera float32 contiguo; así se evitan copias ocultas en cada búsqueda
+                with torch.inference_mode():
+                    embedding = np.ascontiguousarray(
+                        self.model.encode([query], normalize_embeddings=True),
+                        dtype=np.float32
+                    )
+            
+            with self._embedding_cache_lock:
+                self._embedding_cache[key] = embedding
+                if len(self._embedding_cache) > EMBEDDING_CACHE_SIZE:
+                    self._embedding_cache.popitem(last=False)
+                self._embedding_cache_misses += 1
+        
+        total = self._embedding_cache_hits + self._embedding_cache_misses
+        logger.info(f"🧠 Caché de embeddings: {self._embedding_cache_hits}/{total} aciertos ({self._embedding_cache_hits / total:.0%})")
+        
+        return embedding
+    
+    def _semantic_search(self, query_embedding, k):
+        """Búsqueda FAISS con caché LSH para consultas casi idénticas (coseno >= umbral)"""
+        signature = np.packbits((query_embedding @ self._lsh_planes.T)[0] > 0).tobytes()
+        bucket_key = (k, signature)
         
-        def normalize(text):
-            text = unicodedata.normalize('NFD', text)
-            text = ''.join(c for c in text if unicodedata.category(c) != 'Mn')
-            return text.lower()
+        with self._semantic_cache_lock:
+            for cached_embedding, scores, indices in self._semantic_cache.get(bucket_key, ()):
+                if float(cached_embedding[0] @ query_embedding[0]) >= SEMANTIC_CACHE_THRESHOLD:
+                    self._semantic_cache.move_to_end(bucket_key)
+                    logger.info("⚡ Candidatos semánticos recuperados de la caché")
+                    return scores, indices
+        
+        scores, indices = self.index.search(query_embedding, k)
+        
+        with self._semantic_cache_lock:
+            bucket = self._semantic_cache.get(bucket_key)
+            if bucket is None:
+                bucket = self._semantic_cache[bucket_key] = deque(maxlen=SEMANTIC_CACHE_BUCKET_SIZE)
+            bucket.append((query_embedding, scores, indices))
+            self._semantic_cache.move_to_end(bucket_key)
+            if len(self._semantic_cache) > SEMANTIC_CACHE_SIZE:
+                self._semantic_cache.popitem(last=False)
+        
+        return scores, indices
+    
+    def keyword_search(self, query, documents):
+        """Búsqueda por palabras clave mejorada con sinónimos.
+
+        Devuelve un arreglo con la puntuación de cada documento (mismo orden que `documents`).
+        """
+        normalize = _normalize
         
         query_normalized = normalize(query)
         query_words = query_normalized.split()
         
-        # Sinónimos del dominio AMPLIADOS
-        synonyms = {
-            'matricula': ['matricula', 'inscripcion', 'registro'],
-            'convalidacion': ['convalidacion', 'validacion', 'reconocimiento'],
-            'excepcion': ['excepcion', 'especial', 'extraordinaria'],
-            'requisitos': ['requisitos', 'documentos', 'expediente'],
-            'cronograma': ['cronograma', 'fecha', 'fechas', 'calendario', 'plazo', 'cuando', 'cuanto'],
-            'reserva': ['reserva', 'suspension', 'pausa'],
-            'reactualizacion': ['reactualizacion', 'reactivacion', 'renovacion'],
-            'presentar': ['presentar', 'entregar', 'donde', 'lugar'],
-            'expediente': ['expediente', 'tramite', 'solicitud', 'documento'],
-            'criterios': ['criterios', 'requisitos', 'condiciones', 'exigencias'],
-            'academicos': ['academicos', 'academicas', 'educativos', 'curriculares'],
-            'creditaje': ['creditaje', 'creditos', 'credito', 'unidades'],
-            'contenidos': ['contenidos', 'contenido', 'temas', 'silabo', 'programa'],
-            'similitud': ['similitud', 'equivalencia', 'parecido', 'semejanza'],
-            'institutos': ['institutos', 'instituto', 'cetpro', 'senati', 'sencico'],
-            'restricciones': ['restricciones', 'limitaciones', 'prohibiciones', 'no se puede', 'no se permite'],
-            'pueden': ['pueden', 'puede', 'se puede', 'es posible', 'permiten'],
-            'costo': ['costo', 'precio', 'pago', 'tasa', 'tarifa', 'cuanto cuesta', 'cuanto es', 'valor', 'monto'],
-            'modalidad': ['modalidad', 'tipo', 'categoria', 'ordinario', 'profesional', 'ceprunsa', 'traslado'],
-            'validar': ['validar', 'validacion', 'confirmar', 'confirmacion'],
-            'obligatorio': ['obligatorio', 'obligatoriamente', 'debe', 'requerido', 'necesario'],
-            'finalizar': ['finalizar', 'terminar', 'culminar', 'concluir', 'completar'],
-            'constancia': ['constancia', 'documento', 'comprobante', 'certificado'],
-            'imprimir': ['imprimir', 'descargar', 'obtener'],
-            'acto': ['acto', 'accion', 'procedimiento', 'proceso', 'tramite'],
-            'formal': ['formal', 'oficial', 'administrativo'],
-            'acredita': ['acredita', 'certifica', 'avala', 'valida', 'reconoce'],
-            'condicion': ['condicion', 'estado', 'situacion', 'calidad'],
-            'definicion': ['que es', 'cual es', 'define', 'definicion', 'concepto', 'significa'],
-            'ocurre': ['ocurre', 'pasa', 'sucede', 'acontece', 'resulta'],
-            'dejan': ['dejan', 'abandonan', 'no se matriculan', 'no matricularse', 'dejar de'],
-            'pierden': ['pierden', 'perder', 'perdida', 'perderse'],
-            'postular': ['postular', 'volver a postular', 'postulacion', 'admision'],
-            'adicionales': ['adicionales', 'extras', 'extra', 'mas', 'de mas'],
-            'otorga': ['otorga', 'da', 'concede', 'permite', 'autoriza'],
-            'pendiente': ['pendiente', 'sin aprobar', 'reprobado', 'desaprobado'],
-            'contactar': ['contactar', 'comunicarse', 'escribir', 'enviar mensaje'],
-            'correo': ['correo', 'email', 'correo electronico', 'direccion electronica'],
-            'talleres': ['talleres', 'taller', 'extracurriculares', 'extracurricular', 'actividades complementarias'],
-            'inscribirse': ['inscribirse', 'inscripcion', 'registrarse', 'registro', 'matricularse'],
-            # ✅ NUEVOS SINÓNIMOS PARA MATRÍCULA POR EXCEPCIÓN
-            'egresar': ['egresar', 'culminar', 'terminar', 'finalizar carrera'],
-            'paralelo': ['paralelo', 'simultaneo', 'al mismo tiempo', 'juntas', 'juntos'],
-            'faltan': ['faltan', 'me faltan', 'solo me faltan', 'quedan']
-        }
-        
         # Expandir query con sinónimos
         expanded_words = set(query_words)
         for word in query_words:
-            for key, syn_list in synonyms.items():
-                if word in syn_list:
-                    expanded_words.update(syn_list)
+            expanded_words.update(SYNONYM_EXPANSIONS.get(word, ()))
         
         # Detectar tipo de pregunta
-        date_question = any(w in query_normalized for w in ['cuando', 'fecha', 'fechas', 'plazo', 'cronograma'])
-        place_question = any(w in query_normalized for w in ['donde', 'lugar', 'presentar', 'entregar'])
-        academic_question = any(w in query_normalized for w in ['criterios', 'requisitos', 'academico', 'creditaje', 'contenido', 'similitud'])
+        question_types = _matched_categories(query_normalized, QUESTION_TERMS, QUESTION_TERMS_AUTOMATON)
+        
+        def asks(question_type):
+            return question_type in question_types
+        
+        date_question = asks('date')
+        place_question = asks('place')
+        academic_question = asks('academic')
         
         restriction_question = (
-            any(w in query_normalized for w in ['se pueden', 'se puede', 'puedo', 'permiten', 'permite', 'instituto', 'restriccion', 'prohibido', 'no se'])
+            asks('restriction')
             and 'matricula por excepcion' not in query_normalized
             and 'excepcion' not in query_normalized
         )
         
-        cost_question = any(w in query_normalized for w in ['cuanto', 'cuesta', 'costo', 'precio', 'pago', 'tasa', 'tarifa', 'valor', 'monto', 's/'])
-        
-        validation_question = any(w in query_normalized for w in [
-            'validar', 'validacion', 'finalizar', 'terminar', 'culminar', 
-            'obligatorio', 'obligatoriamente', 'debe', 'despues de registrar',
-            'al finalizar', 'al terminar', 'constancia'
-        ])
-        
-        definition_question = any(phrase in query_normalized for phrase in [
-            'que es', 'cual es', 'que significa', 'define', 'definicion',
-            'concepto', 'se considera', 'se entiende por',
-            'acto formal', 'acto voluntario', 'acredita la condicion'
-        ])
-        
-        payment_procedure_question = any(w in query_normalized for w in [
-            'varios recibos', 'un solo recibo', 'un recibo', 'varios pagos', 
-            'puedo pagar', 'como pago', 'forma de pago', 'procedimiento de pago',
-            'en cuotas', 'en partes', 'fraccionado'
-        ])
-        
-        amount_question = any(w in query_normalized for w in [
-            'cuanto cuesta', 'cuanto es', 'cual es el costo', 'cual es el precio',
-            'monto', 'valor', 's/', 'soles'
-        ])
-        
-        consequence_question = any(phrase in query_normalized for phrase in [
-            'que ocurre', 'que pasa', 'que sucede',
-            'dejan de matricularse', 'no se matriculan', 'no matricularse',
-            'mas de tres', 'mas de 3', 'despues de tres', 'luego de tres',
-            'pierden', 'perder la condicion', 'volver a postular'
-        ])
-        
-        credits_question = any(phrase in query_normalized for phrase in [
-            'creditos adicionales', 'creditos extra', 'creditos de mas',
-            'cuantos creditos adicionales', 'cuantos creditos extras',
-            'cuantos creditos mas', 'creditos adicionales me otorga',
-            'sin cursos pendientes', 'no tengo cursos pendientes',
-            'ningun curso pendiente', 'sin ningún curso pendiente'
-        ])
-        
-        contact_question = any(phrase in query_normalized for phrase in [
-            'que correo', 'cual es el correo', 'correo electronico',
-            'a que correo', 'donde contactar', 'como contactar',
-            'talleres extracurriculares', 'talleres', 'inscribirme en talleres',
-            'oficina de', 'upacdr'
-        ])
-        
-        exception_enrollment_question = any(phrase in query_normalized for phrase in [
-            'matricula por excepcion',
-            'por excepcion',
-            'excepcionalmente',
-            'faltan dos asignaturas',
-            'dos asignaturas para egresar',
-            'una es prerrequisito',
-            'llevarlas juntas',
-            'llevar en paralelo',
-            'llevar las dos'
-        ])
+        cost_question = asks('cost')
+        validation_question = asks('validation')
+        definition_question = asks('definition')
+        payment_procedure_question = asks('payment_procedure')
+        amount_question = asks('amount')
+        consequence_question = asks('consequence')
+        credits_question = asks('credits')
+        contact_question = asks('contact')
+        exception_enrollment_question = asks('exception_enrollment')
         
         # ✅ NUEVO: Detectar preguntas sobre AUTORIDADES/RESPONSABLES
-        authority_question = any(phrase in query_normalized for phrase in [
-            'quien establece',
-            'quien programa',
-            'quien define',
-            'quien aprueba',
-            'quien determina',
-            'que entidad',
-            'que organo',
-            'consejo universitario',
-            'decano',
-            'director',
-            'vicerrectorado'
-        ])
+        authority_question = asks('authority')
         
         # ✅ NUEVO: Detectar preguntas sobre EQUIVALENCIA DE ABANDONO
-        equivalence_question = any(phrase in query_normalized for phrase in [
-            'equivalente',
-            'equivale',
-            'es equivalente a',
-            'abandono es equivalente',
-            'condicion de abandono',
-            'conteo de matriculas',
-            'matriculas ejecutadas'
-        ])
+        equivalence_question = asks('equivalence')
         
         # ✅ NUEVO: Detectar TODOS los tipos de preguntas sobre lugares de pago
         lugar_pago_matricula_question = (
             'matricula' in query_normalized and 
             place_question and 
-            any(w in query_normalized for w in ['pagar', 'pago', 'derechos', 'tasa'])
+            asks('payment_place')
         )
         
         lugar_pago_convalidacion_question = (
             'convalidacion' in query_normalized and 
             place_question and 
-            any(w in query_normalized for w in ['pagar', 'pago', 'derechos', 'tasa'])
+            asks('payment_place')
         )
         
         lugar_pago_modificacion_question = (
             'modificacion' in query_normalized and 
             place_question and 
-            any(w in query_normalized for w in ['pagar', 'pago', 'derechos', 'tasa'])
+            asks('payment_place')
         )
         
         lugar_presentacion_expediente_question = (
             place_question and 
-            any(w in query_normalized for w in ['presentar', 'entregar', 'expediente', 'solicitud', 'tramite'])
+            asks('submission_place')
         )
         
-        keyword_scores = defaultdict(float)
+        keyword_scores = np.zeros(len(documents), dtype=np.float64)
+        
+        if documents is self.documents:
+            normalized = self._normalized
+            features = self._features
+            # Palabras del vocabulario de sinónimos: conteos precalculados
+            vocab_columns = [self._vocabulary[w] for w in expanded_words if w in self._vocabulary]
+            vocab_counts = self._term_counts[:, vocab_columns].sum(axis=1)
+            runtime_words = {w for w in expanded_words if w not in self._vocabulary}
+        else:
+            normalized = _normalize_fields(documents)
+            features = _document_features(documents, normalized)
+            vocab_counts = np.zeros(len(documents), dtype=np.int32)
+            runtime_words = expanded_words
+        
+        # Resto de palabras: un solo autómata por consulta, cada documento se recorre una vez
+        words_automaton = None
+        if ahocorasick is not None and runtime_words:
+            words_automaton = _query_automaton(frozenset(runtime_words))
+        
+        # LÓGICA ESPECIAL PARA PREGUNTAS DE MONTO: solo los documentos con tasa pueden puntuar
+        amount_only_question = (
+            cost_question and amount_question and not payment_procedure_question
+            and not any([
+                authority_question, equivalence_question, exception_enrollment_question,
+                contact_question, credits_question, consequence_question,
+                definition_question, validation_question
+            ])
+        )
+        
+        if amount_only_question:
+            query_modalidades = 0
+            if 'ordinario' in query_normalized:
+                query_modalidades |= MODALIDAD_BITS['ordinario']
+            if 'profesional' in query_normalized or 'profesionales' in query_normalized:
+                query_modalidades |= MODALIDAD_BITS['profesionales']
+            if 'ceprunsa' in query_normalized:
+                query_modalidades |= MODALIDAD_BITS['ceprunsa']
+            if 'traslado' in query_normalized:
+                query_modalidades |= MODALIDAD_BITS['traslado']
+            
+            # Solo cuenta una procedencia: particular > nacional (otra) > otra escuela UNSA
+            query_procedencia = 0
+            if 'universidad particular' in query_normalized or 'universidad privada' in query_normalized:
+                query_procedencia = PROCEDENCIA_BITS['universidad_particular']
+            elif 'universidad nacional' in query_normalized and 'otra' in query_normalized:
+                query_procedencia = PROCEDENCIA_BITS['universidad_nacional_otra']
+            elif 'otra escuela' in query_normalized or 'escuela unsa' in query_normalized:
+                query_procedencia = PROCEDENCIA_BITS['otra_escuela_unsa']
+            
+            has_modalidad = features['modalidad']
+            modalidad_match = has_modalidad & ((features['modalidad_flags'] & query_modalidades) != 0)
+            procedencia_match = has_modalidad & ((features['procedencia_flags'] & query_procedencia) != 0)
+            
+            # Documentos CON tasa: 1000 base, +500 modalidad, +800 procedencia; penalizar lo que no coincide
+            amount_scores = 1000.0 + 500 * modalidad_match + 800 * procedencia_match
+            if query_modalidades:
+                amount_scores[has_modalidad & ~modalidad_match] = 10
+            if query_procedencia:
+                amount_scores[has_modalidad & ~procedencia_match] *= 0.05
+            
+            keyword_scores[:] = np.where(features['tasa_soles'], amount_scores, 0.0)
+            logger.info(
+                f"    💰 Pregunta de monto: {int(features['tasa_soles'].sum())} documentos con tasa, "
+                f"{int((features['tasa_soles'] & modalidad_match).sum())} con modalidad y "
+                f"{int((features['tasa_soles'] & procedencia_match).sum())} con procedencia coincidente"
+            )
+            
+            return keyword_scores
+        
+        keyword_counts = features['keyword_counts']
+        
+        # Bonos por tipo de pregunta que solo dependen del documento: una expresión para todos
+        document_bonus = np.zeros(len(documents), dtype=np.int64)
+        
+        # BONUS para preguntas sobre RESTRICCIONES
+        if restriction_question:
+            document_bonus += 60 * keyword_counts['restriction']
+            document_bonus += 70 * features['restriction_sub_categoria']
+            document_bonus += 50 * keyword_counts['negation']
+        
+        # BONUS para preguntas sobre criterios académicos
+        if academic_question:
+            document_bonus += 40 * keyword_counts['academic']
+            document_bonus += 50 * features['academic_sub_categoria']
+        
+        # BONUS EXTRA para documentos con fechas
+        if date_question:
+            document_bonus += 50 * features['date_pattern']
+            document_bonus += 40 * features['fecha_relevante']
+            document_bonus += 30 * features['actividad_cronograma']
+        
+        # BONUS EXTRA para documentos con lugares
+        if place_question:
+            document_bonus += 20 * keyword_counts['place']
+            document_bonus += 35 * features['lugar_pago']
+        
+        # Bonus por categoría: hay pocas categorías distintas, se evalúa cada una una sola vez
+        categoria_matches = {
+            categoria: any(w in categoria for w in expanded_words)
+            for categoria in set(normalized['categoria_principal'])
+        }
         
         for i, doc in enumerate(documents):
-            content_normalized = normalize(doc['content'])
+            content_normalized = normalized['content'][i]
             score = 0
             
             # ✅ LÓGICA ESPECIAL PARA PREGUNTAS SOBRE AUTORIDADES (DEBE IR PRIMERO)
             if authority_question:
-                authority_keywords = [
-                    'consejo universitario',
-                    'establecera',
-                    'establece',
-                    'calendario academico',
-                    'programa las fechas',
-                    'programara',
-                    'articulo 11',
-                    'anualmente'
-                ]
-                
-                matches = sum(1 for kw in authority_keywords if kw in content_normalized)
+                matches = int(keyword_counts['authority'][i])
                 
                 has_council = 'consejo universitario' in content_normalized
                 has_calendar = 'calendario academico' in content_normalized
@@ -304,18 +1279,7 @@ class RAGService:
             
             # ✅ LÓGICA ESPECIAL PARA PREGUNTAS SOBRE EQUIVALENCIA DE ABANDONO
             if equivalence_question:
-                equivalence_keywords = [
-                    'abandono',
-                    'equivalente',
-                    'desaprobacion',
-                    'conteo de matriculas',
-                    'matriculas ejecutadas',
-                    'calificacion final',
-                    'disposicion final',
-                    'primera'
-                ]
-                
-                matches = sum(1 for kw in equivalence_keywords if kw in content_normalized)
+                matches = int(keyword_counts['equivalence'][i])
                 
                 has_abandonment = 'abandono' in content_normalized
                 has_equivalent = any(word in content_normalized for word in ['equivalente', 'equivale'])
@@ -342,22 +1306,8 @@ class RAGService:
             
             # ✅ LÓGICA ESPECIAL PARA MATRÍCULA POR EXCEPCIÓN
             if exception_enrollment_question:
-                # Palabras clave críticas
-                exception_keywords = [
-                    'matricula por excepcion',
-                    'excepcion',
-                    'dos (2) asignaturas',
-                    'dos asignaturas',
-                    'para egresar',
-                    'egresar',
-                    'prerrequisito',
-                    'en paralelo',
-                    'llevar las dos',
-                    'simultaneamente'
-                ]
-                
                 # Buscar coincidencias
-                matches = sum(1 for kw in exception_keywords if kw in content_normalized)
+                matches = int(keyword_counts['exception_enrollment'][i])
                 
                 # Bonus especial si es el documento MEX-003-EGR2 o similar
                 has_two_courses = any(phrase in content_normalized for phrase in ['dos (2) asignaturas', 'dos asignaturas', 'falte solo dos'])
@@ -385,21 +1335,8 @@ class RAGService:
             
             # LÓGICA ESPECIAL PARA PREGUNTAS DE CONTACTO/TALLERES
             if contact_question:
-                # Palabras clave críticas
-                contact_keywords = [
-                    'talleres extracurriculares',
-                    'taller',
-                    'correo',
-                    'upacdr',
-                    'oficina de promocion',
-                    'arte, cultura, deporte',
-                    'contactar',
-                    'inscripcion',
-                    '@unsa.edu.pe'
-                ]
-                
                 # Buscar coincidencias
-                matches = sum(1 for kw in contact_keywords if kw in content_normalized)
+                matches = int(keyword_counts['contact'][i])
                 
                 # Bonus especial si es el documento de talleres extracurriculares
                 has_talleres = 'talleres extracurriculares' in content_normalized
@@ -426,19 +1363,7 @@ class RAGService:
             
             # LÓGICA ESPECIAL PARA PREGUNTAS SOBRE CRÉDITOS ADICIONALES
             if credits_question:
-                credit_keywords = [
-                    'seis (6) creditos adicionales',
-                    'seis (06) creditos adicionales',
-                    '6 creditos adicionales',
-                    '06 creditos adicionales',
-                    'creditos adicionales',
-                    'sin cursos pendientes',
-                    'ningun curso pendiente',
-                    'no tengan ningun curso',
-                    'sistema considera automaticamente'
-                ]
-                
-                matches = sum(1 for kw in credit_keywords if kw in content_normalized)
+                matches = int(keyword_counts['credits'][i])
                 
                 has_six = any(num in content_normalized for num in ['seis (6)', 'seis (06)', '6 creditos', '06 creditos'])
                 has_additional = 'creditos adicionales' in content_normalized
@@ -464,15 +1389,7 @@ class RAGService:
             
             # LÓGICA ESPECIAL PARA PREGUNTAS SOBRE CONSECUENCIAS
             if consequence_question:
-                consequence_keywords = [
-                    'perderan', 'pierden', 'perder', 'perdida',
-                    'condicion de estudiante', 'condicion',
-                    'postular nuevamente', 'volver a postular', 'postulacion',
-                    'mas de tres', 'mas de 3 anos', 'tres anos',
-                    'consecutivos o alternos', 'consecutivos', 'alternos'
-                ]
-                
-                matches = sum(1 for kw in consequence_keywords if kw in content_normalized)
+                matches = int(keyword_counts['consequence'][i])
                 
                 if matches >= 2:
                     score = 3000 + (matches * 300)
@@ -488,12 +1405,6 @@ class RAGService:
             
             # LÓGICA ESPECIAL PARA PREGUNTAS CONCEPTUALES
             if definition_question:
-                definition_keywords = [
-                    'es el acto', 'se considera', 'se define', 'definicion',
-                    'acto formal', 'acto voluntario', 'acredita', 'condicion de estudiante',
-                    'articulo 3', 'articulo 4', 'articulo'
-                ]
-                
                 if 'acto formal' in query_normalized and 'acredita' in query_normalized:
                     if 'acto formal' in content_normalized and 'acredita' in content_normalized and 'condicion de estudiante' in content_normalized:
                         score = 3000
@@ -501,7 +1412,7 @@ class RAGService:
                     else:
                         score = 50
                 else:
-                    matches = sum(1 for kw in definition_keywords if kw in content_normalized)
+                    matches = int(keyword_counts['definition'][i])
                     if matches > 0:
                         score = 2000 + (matches * 200)
                         logger.info(f"    ✅ Definición encontrada en {doc.get('id_chunk')}: {matches} keywords")
@@ -513,13 +1424,7 @@ class RAGService:
             
             # LÓGICA ESPECIAL PARA PREGUNTAS DE VALIDACIÓN
             if validation_question:
-                validation_keywords = [
-                    'validar', 'validacion', 'validar su matricula',
-                    'obligatorio', 'obligado', 'debe',
-                    'constancia', 'imprimir', 'finalizar', 'finalmente'
-                ]
-                
-                matches = sum(1 for kw in validation_keywords if kw in content_normalized)
+                matches = int(keyword_counts['validation'][i])
                 
                 if matches > 0:
                     score = 2000 + (matches * 200)
@@ -533,8 +1438,7 @@ class RAGService:
             # LÓGICA ESPECIAL PARA PREGUNTAS DE COSTOS
             if cost_question:
                 if payment_procedure_question:
-                    payment_keywords = ['recibo', 'recibos', 'un solo', 'todas las asignaturas', 'monto total', 'pago']
-                    keyword_count = sum(1 for kw in payment_keywords if kw in content_normalized)
+                    keyword_count = int(keyword_counts['payment_procedure'][i])
                     
                     if keyword_count > 0:
                         score = 2000 + (keyword_count * 100)
@@ -545,72 +1449,6 @@ class RAGService:
                     keyword_scores[i] = score
                     continue
                 
-                elif amount_question:
-                    if 'tasa_soles' not in doc or not doc.get('tasa_soles'):
-                        keyword_scores[i] = 0
-                        continue
-                    
-                    score = 1000
-                    
-                    modalidades_en_query = []
-                    if 'ordinario' in query_normalized:
-                        modalidades_en_query.append('ordinario')
-                    if 'profesional' in query_normalized or 'profesionales' in query_normalized:
-                        modalidades_en_query.append('profesionales')
-                    if 'ceprunsa' in query_normalized:
-                        modalidades_en_query.append('ceprunsa')
-                    if 'traslado' in query_normalized:
-                        modalidades_en_query.append('traslado')
-                    
-                    procedencias_en_query = []
-                    if 'otra escuela' in query_normalized or 'escuela unsa' in query_normalized:
-                        procedencias_en_query.append('otra_escuela_unsa')
-                    if 'universidad nacional' in query_normalized and 'otra' in query_normalized:
-                        procedencias_en_query.append('universidad_nacional_otra')
-                    if 'universidad particular' in query_normalized or 'universidad privada' in query_normalized:
-                        procedencias_en_query.append('universidad_particular')
-                    
-                    doc_modalidad_value = doc.get('modalidad_pago_relacionada', '')
-                    if doc_modalidad_value:
-                        doc_modalidad_norm = normalize(doc_modalidad_value)
-                        
-                        modalidad_match = False
-                        procedencia_match = False
-                        
-                        for modalidad in modalidades_en_query:
-                            if modalidad in doc_modalidad_norm:
-                                modalidad_match = True
-                                score += 500
-                                logger.info(f"    ✅ Modalidad '{modalidad}' encontrada en {doc.get('id_chunk')}")
-                                break
-                        
-                        if 'universidad_particular' in procedencias_en_query:
-                            if 'universidad particular' in doc_modalidad_norm:
-                                procedencia_match = True
-                                score += 800
-                                logger.info(f"    ✅ Procedencia 'universidad particular' encontrada en {doc.get('id_chunk')}")
-                        elif 'universidad_nacional_otra' in procedencias_en_query:
-                            if 'universidad nacional' in doc_modalidad_norm and 'otra' in doc_modalidad_norm:
-                                procedencia_match = True
-                                score += 800
-                                logger.info(f"    ✅ Procedencia 'universidad nacional (otra)' encontrada en {doc.get('id_chunk')}")
-                        elif 'otra_escuela_unsa' in procedencias_en_query:
-                            if 'otra escuela de la unsa' in doc_modalidad_norm or 'escuela de la unsa' in doc_modalidad_norm:
-                                procedencia_match = True
-                                score += 800
-                                logger.info(f"    ✅ Procedencia 'otra escuela UNSA' encontrada en {doc.get('id_chunk')}")
-                        
-                        if modalidades_en_query and not modalidad_match:
-                            score = 10
-                            logger.info(f"    ❌ Modalidad NO coincide en {doc.get('id_chunk')}: '{doc_modalidad_value}'")
-                        
-                        if procedencias_en_query and not procedencia_match:
-                            score = score * 0.05
-                            logger.info(f"    ❌ Procedencia NO coincide en {doc.get('id_chunk')}: '{doc_modalidad_value}'")
-                    
-                    keyword_scores[i] = score
-                    continue
-                
                 else:
                     if 'tasa_soles' in doc and doc.get('tasa_soles'):
                         score = 1000
@@ -623,80 +1461,19 @@ class RAGService:
                     continue
             
             # Para preguntas NO especiales, usar lógica normal
-            for word in expanded_words:
-                if word in content_normalized:
-                    count = content_normalized.count(word)
-                    score += count * 2
+            score += 2 * int(vocab_counts[i])
+            if words_automaton is not None:
+                score += 2 * sum(1 for _ in words_automaton.iter(content_normalized))
+            else:
+                for word in runtime_words:
+                    if word in content_normalized:
+                        count = content_normalized.count(word)
+                        score += count * 2
             
             if query_normalized in content_normalized:
                 score += 30
             
-            # BONUS para preguntas sobre RESTRICCIONES
-            if restriction_question:
-                restriction_keywords = ['no se convalidan', 'restriccion', 'prohibido', 'no se permite', 'instituto', 'institutos', 'obligatorio']
-                for kw in restriction_keywords:
-                    if kw in content_normalized:
-                        score += 60
-                
-                if 'sub_categoria' in doc:
-                    sub_cat_value = doc.get('sub_categoria', '')
-                    if sub_cat_value:
-                        sub_cat = normalize(sub_cat_value)
-                        if 'restriccion' in sub_cat or 'limitacion' in sub_cat:
-                            score += 70
-                
-                negation_patterns = [
-                    r'no se convalidan',
-                    r'no se puede',
-                    r'no se permite',
-                    r'prohibido',
-                    r'es obligatorio'
-                ]
-                
-                for pattern in negation_patterns:
-                    if re.search(pattern, content_normalized):
-                        score += 50
-            
-            # BONUS para preguntas sobre criterios académicos
-            if academic_question:
-                academic_keywords = ['creditaje', 'creditos', 'similitud', '80%', 'contenido', 'igual', 'mayor']
-                for kw in academic_keywords:
-                    if kw in content_normalized:
-                        score += 40
-                
-                if 'sub_categoria' in doc:
-                    sub_cat_value = doc.get('sub_categoria', '')
-                    if sub_cat_value and 'academico' in normalize(sub_cat_value):
-                        score += 50
-            
-            # BONUS EXTRA para documentos con fechas
-            if date_question:
-                date_patterns = [
-                    r'\d{1,2}\s+de\s+\w+',
-                    r'del\s+\d{1,2}\s+al\s+\d{1,2}',
-                    r'\d{1,2}\s*[-/]\s*\d{1,2}',
-                ]
-                
-                for pattern in date_patterns:
-                    if re.search(pattern, content_normalized):
-                        score += 50
-                        break
-                
-                if 'fecha_relevante' in doc and doc['fecha_relevante']:
-                    score += 40
-                
-                if 'actividad_cronograma' in doc and doc['actividad_cronograma']:
-                    score += 30
-            
-            # BONUS EXTRA para documentos con lugares
-            if place_question:
-                place_keywords = ['escuela', 'oficina', 'caja', 'lugar', 'presentar', 'entregar']
-                for kw in place_keywords:
-                    if kw in content_normalized:
-                        score += 20
-                
-                if 'lugar_pago' in doc and doc['lugar_pago']:
-                    score += 35
+            score += int(document_bonus[i])
             
             # Bonus por keywords del documento
             if 'keywords' in doc:
@@ -705,12 +1482,8 @@ class RAGService:
                         score += 10
             
             # Bonus por categoría relevante
-            if 'categoria_principal' in doc:
-                categoria_value = doc.get('categoria_principal', '')
-                if categoria_value:
-                    categoria = normalize(categoria_value)
-                    if any(w in categoria for w in expanded_words):
-                        score += 15
+            if categoria_matches[normalized['categoria_principal'][i]]:
+                score += 15
             
             keyword_scores[i] = score
             
@@ -722,183 +1495,146 @@ class RAGService:
             return []
         
         # Búsqueda semántica
-        query_embedding = self.model.encode([query])
-        faiss.normalize_L2(query_embedding)
-        scores, indices = self.index.search(query_embedding, top_k * 3)
+        query_embedding = self._encode_query(query)
+        scores, indices = self._semantic_search(query_embedding, top_k * 3)
         
         # Búsqueda por palabras clave
         keyword_scores = self.keyword_search(query, self.documents)
         
         # Detectar tipo de pregunta
         query_lower = query.lower()
-        is_date_query = any(w in query_lower for w in ['cuando', 'fecha', 'fechas', 'plazo', 'cronograma'])
-        is_place_query = any(w in query_lower for w in ['donde', 'lugar', 'presentar', 'entregar'])
+        query_types = _matched_categories(query_lower, QUERY_WEIGHT_TERMS, QUERY_WEIGHT_TERMS_AUTOMATON)
+        is_date_query = 'date' in query_types
+        is_place_query = 'place' in query_types
         is_restriction_query = (
-            any(w in query_lower for w in ['se pueden', 'se puede', 'puedo', 'permiten', 'permite', 'instituto', 'restriccion', 'prohibido'])
+            'restriction' in query_types
             and 'matricula por excepcion' not in query_lower
             and 'excepcion' not in query_lower
         )
-        is_cost_query = any(w in query_lower for w in ['cuanto', 'cuesta', 'costo', 'precio', 'pago', 'tasa', 'tarifa', 'valor', 'monto', 's/'])
-        is_validation_query = any(w in query_lower for w in ['validar', 'validacion', 'finalizar', 'terminar', 'obligatorio', 'obligatoriamente', 'constancia', 'al finalizar'])
-        is_definition_query = any(phrase in query_lower for phrase in ['que es', 'cual es', 'que significa', 'define', 'definicion', 'concepto', 'acto formal', 'acredita la condicion'])
-        is_consequence_query = any(phrase in query_lower for phrase in ['que ocurre', 'que pasa', 'que sucede', 'dejan de matricularse', 'mas de tres', 'pierden'])
-        is_credits_query = any(phrase in query_lower for phrase in ['creditos adicionales', 'creditos extra', 'cuantos creditos', 'sin cursos pendientes', 'ningun curso pendiente'])
-        is_contact_query = any(phrase in query_lower for phrase in ['que correo', 'cual es el correo', 'correo electronico', 'talleres extracurriculares', 'talleres', 'contactar', 'inscribirme'])
+        is_cost_query = 'cost' in query_types
+        is_validation_query = 'validation' in query_types
+        is_definition_query = 'definition' in query_types
+        is_consequence_query = 'consequence' in query_types
+        is_credits_query = 'credits' in query_types
+        is_contact_query = 'contact' in query_types
         # ✅ NUEVO
-        is_exception_enrollment_query = any(phrase in query_lower for phrase in ['matricula por excepcion', 'por excepcion', 'faltan dos asignaturas', 'llevarlas juntas', 'llevar en paralelo'])
+        is_exception_enrollment_query = 'exception_enrollment' in query_types
         # ✅ NUEVO
-        is_authority_query = any(phrase in query_lower for phrase in ['quien establece', 'quien programa', 'quien define', 'consejo universitario', 'que entidad', 'que organo'])
+        is_authority_query = 'authority' in query_types
         # ✅ NUEVO
-        is_equivalence_query = any(phrase in query_lower for phrase in ['equivalente', 'equivale', 'es equivalente a', 'abandono es equivalente', 'conteo de matriculas'])
+        is_equivalence_query = 'equivalence' in query_types
         
         # Detección específica de lugares
-        is_lugar_pago_question = (
-            is_place_query and 
-            any(w in query_lower for w in ['pagar', 'pago', 'caja', 'derechos', 'tasa'])
-        )
+        is_lugar_pago_question = is_place_query and 'payment_place' in query_types
         
-        is_lugar_presentacion_question = (
-            is_place_query and 
-            any(w in query_lower for w in ['presentar', 'entregar', 'expediente', 'tramite'])
-        )
+        is_lugar_presentacion_question = is_place_query and 'submission_place' in query_types
         
-        # Combinar puntuaciones
-        combined_results = []
-        for i, score in enumerate(scores[0]):
-            if score > 0.2:
-                doc_idx = indices[0][i]
-                semantic_score = float(score)
-                keyword_score = keyword_scores.get(doc_idx, 0)
-                
-                # Ajustar pesos dinámicamente
-                if is_lugar_pago_question or is_lugar_presentacion_question:
-                    # ✅ PRIORIZAR keywords para TODAS las preguntas de lugares
-                    combined_score = (semantic_score * 0.05) + (keyword_score * 0.95)
-                elif is_equivalence_query:
-                    combined_score = (semantic_score * 0.05) + (keyword_score * 0.95)
-                elif is_authority_query:
-                    combined_score = (semantic_score * 0.05) + (keyword_score * 0.95)
-                elif is_exception_enrollment_query:
-                    combined_score = (semantic_score * 0.05) + (keyword_score * 0.95)
-                elif is_contact_query:
-                    combined_score = (semantic_score * 0.05) + (keyword_score * 0.95)
-                elif is_credits_query:
-                    combined_score = (semantic_score * 0.05) + (keyword_score * 0.95)
-                elif is_consequence_query:
-                    combined_score = (semantic_score * 0.05) + (keyword_score * 0.95)
-                elif is_definition_query:
-                    combined_score = (semantic_score * 0.05) + (keyword_score * 0.95)
-                elif is_validation_query:
-                    combined_score = (semantic_score * 0.1) + (keyword_score * 0.9)
-                elif is_cost_query:
-                    combined_score = (semantic_score * 0.2) + (keyword_score * 0.8)
-                elif is_restriction_query:
-                    combined_score = (semantic_score * 0.3) + (keyword_score * 0.7)
-                elif is_date_query or is_place_query:
-                    combined_score = (semantic_score * 0.4) + (keyword_score * 0.6)
-                else:
-                    combined_score = (semantic_score * 0.7) + (keyword_score * 0.3)
-                
-                combined_results.append({
-                    'documento': self.documents[doc_idx],
-                    'score': combined_score,
-                    'semantic_score': semantic_score,
-                    'keyword_score': keyword_score
-                })
+        # Ajustar pesos dinámicamente (semántico, palabras clave)
+        if is_lugar_pago_question or is_lugar_presentacion_question:
+            # ✅ PRIORIZAR keywords para TODAS las preguntas de lugares
+            weights = (0.05, 0.95)
+        elif is_equivalence_query:
+            weights = (0.05, 0.95)
+        elif is_authority_query:
+            weights = (0.05, 0.95)
+        elif is_exception_enrollment_query:
+            weights = (0.05, 0.95)
+        elif is_contact_query:
+            weights = (0.05, 0.95)
+        elif is_credits_query:
+            weights = (0.05, 0.95)
+        elif is_consequence_query:
+            weights = (0.05, 0.95)
+        elif is_definition_query:
+            weights = (0.05, 0.95)
+        elif is_validation_query:
+            weights = (0.1, 0.9)
+        elif is_cost_query:
+            weights = (0.2, 0.8)
+        elif is_restriction_query:
+            weights = (0.3, 0.7)
+        elif is_date_query or is_place_query:
+            weights = (0.4, 0.6)
+        else:
+            weights = (0.7, 0.3)
         
-        # Ordenar por puntuación combinada
-        combined_results.sort(key=lambda x: x['score'], reverse=True)
+        # Combinar puntuaciones de todos los candidatos a la vez
+        semantic = scores[0].astype(np.float64)
+        candidates = indices[0]
+        mask = (semantic > 0.2) & (candidates >= 0)
+        semantic = semantic[mask]
+        candidates = candidates[mask]
+        keyword = keyword_scores[candidates]
+        combined, order = _fuse_scores(semantic, keyword, weights, top_k)
+        # Solo las top_k filas pasan de columnas NumPy a los dicts que consume el resto del servicio
+        combined_results = [
+            {
+                'documento': self.documents[doc_idx],
+                'score': score,
+                'semantic_score': semantic_score,
+                'keyword_score': keyword_score
+            }
+            for doc_idx, score, semantic_score, keyword_score in zip(
+                candidates[order].tolist(),
+                combined[order].tolist(),
+                semantic[order].tolist(),
+                keyword[order].tolist()
+            )
+        ]
         
         # Logging mejorado
         logger.info(f"📊 Query type - Fechas: {is_date_query}, Lugares: {is_place_query}, Restricciones: {is_restriction_query}, Costos: {is_cost_query}, Validación: {is_validation_query}, Definición: {is_definition_query}, Consecuencias: {is_consequence_query}, Créditos: {is_credits_query}, Contacto: {is_contact_query}, Matrícula Excepción: {is_exception_enrollment_query}, Autoridad: {is_authority_query}, Equivalencia: {is_equivalence_query}")
-        logger.info(f"📊 Recuperados {len(combined_results[:top_k])} documentos para: {query[:50]}...")
+        logger.info(f"📊 Recuperados {len(combined_results)} documentos para: {query[:50]}...")
         
-        for i, doc in enumerate(combined_results[:top_k], 1):
+        for i, doc in enumerate(combined_results, 1):
             logger.info(f"  {i}. Score: {doc['score']:.2f} (Sem: {doc['semantic_score']:.2f}, KW: {doc['keyword_score']:.2f})")
         
-        return combined_results[:top_k]
+        return combined_results
     
-    def _ensure_ollama_running(self):
-        """Verificar que Ollama esté corriendo"""
+    def _warmup_ollama(self):
+        """Cargar el modelo en Ollama (sin mensajes) para evitar el arranque en frío"""
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            result = sock.connect_ex(('localhost', 11434))
-            sock.close()
-            
-            if result == 0:
-                logger.info("✅ Ollama está corriendo")
-                return True
-            else:
-                logger.warning("⚠️ Ollama no está corriendo")
-                logger.info("💡 Inicia Ollama con: ollama serve")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error verificando Ollama: {e}")
-            return False
+            _OLLAMA.post(
+                self.ollama_url,
+                data=_json_dumps({
+                    "model": self.ollama_model,
+                    "messages": [],
+                    "keep_alive": OLLAMA_KEEP_ALIVE,
+                    "options": OLLAMA_RUNNER_OPTIONS
+                }),
+                headers=JSON_HEADERS,
+                # Corre en un hilo aparte: conexión rápida, pero sin límite para la carga en frío del modelo
+                timeout=(5, None)
+            )
+        except requests.RequestException as e:
+            logger.warning(f"⚠️ Warmup de Ollama falló: {e}")
     
     def _build_prompt(self, query, context):
-        """Construir prompt optimizado"""
-        return f"""Eres un asistente especializado en normativas académicas de la Universidad Nacional de San Agustín (UNSA).
-
-CONTEXTO (múltiples documentos relacionados):
+        """Construir prompt optimizado: (instrucciones de sistema, contexto + pregunta)"""
+        return SYSTEM_PROMPT, f"""CONTEXTO (múltiples documentos relacionados):
 {context}
 
 PREGUNTA DEL ESTUDIANTE: {query}
 
-INSTRUCCIONES CRÍTICAS:
-
-1. **LEE CUIDADOSAMENTE** cada documento del contexto - están numerados (DOCUMENTO 1, DOCUMENTO 2, etc.)
-
-2. **EXTRAE INFORMACIÓN ESPECÍFICA** según la pregunta:
-   - Si preguntan "DÓNDE": Busca en "📍 Lugar" o en el contenido principal
-   - Si preguntan "CUÁNDO/FECHAS": Busca en "📅 FECHAS" 
-   - Si preguntan "CUÁNTO/COSTO": Busca en "💰 Costo"
-
-3. **NO MEZCLES INFORMACIÓN** de diferentes documentos:
-   - Un documento sobre "Presentación de expedientes" NO es lo mismo que "Pago"
-   - Un documento sobre "Lugar de pago" NO es el lugar de presentación del expediente
-
-4. **PRIORIZA** el documento más relevante,el DOCUMENTO 1 es el MÁS RELEVANTE para esta pregunta.
-   - Si el DOCUMENTO 1 contiene la respuesta completa, ÚSALO y NO mezcles con otros documentos.
-   - Solo usa otros documentos si el DOCUMENTO 1 no tiene información suficiente.
-
-5. **FORMATO DE RESPUESTA**:
-   - Responde de forma directa y estructurada
-   - Si hay fechas, escríbelas como: "Del **17 de marzo** al **28 de marzo**"
-   - Si hay lugares, especifica claramente: "en [lugar exacto]"
-   - Si hay costos, menciónalos: "S/ [monto]"
-   - Brinda la información sin mencionar los documentos de donde la extraiste.
-
-6. **PROHIBIDO**:
-   - Inventar información que no esté en el contexto
-   - Mezclar información de documentos diferentes
-   - Usar plantillas como "[día] de [mes]"
-
-7. Si NO encuentras información específica en el contexto, di: "No encontré información sobre [tema específico]"
-
 RESPUESTA:"""
     
-    def _validate_dates_in_response(self, response, context):
-        """Validar que las fechas mencionadas existan en el contexto"""
-        # Extraer fechas de la respuesta
-        date_patterns = [
-            r'\d{1,2}\s+de\s+\w+',
-            r'del\s+\d{1,2}\s+al\s+\d{1,2}',
+    def _chat_messages(self, system, prompt):
+        """Mensajes para /api/chat: instrucciones fijas primero, contexto y pregunta después"""
+        return [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt}
         ]
-        
-        response_dates = []
-        for pattern in date_patterns:
-            response_dates.extend(re.findall(pattern, response.lower()))
+    
+    def _validate_dates_in_response(self, response, context_dates):
+        """Validar que las fechas mencionadas existan en el contexto (fechas canónicas del contexto)"""
+        # Extraer fechas de la respuesta; '02 de abril' y '2 de abril' son la misma fecha
+        response_dates = _canonical_dates(_normalize_text(response), RESPONSE_RANGE_RE)
         
         # Verificar que cada fecha esté en el contexto
-        context_lower = context.lower()
-        hallucinated_dates = []
+        hallucinated_dates = sorted(response_dates - context_dates)
         
-        for date in response_dates:
-            if date not in context_lower:
-                hallucinated_dates.append(date)
-                logger.warning(f"⚠️ FECHA ALUCINADA DETECTADA: '{date}' no está en el contexto")
+        for date in hallucinated_dates:
+            logger.warning(f"⚠️ FECHA ALUCINADA DETECTADA: '{date}' no está en el contexto")
         
         if hallucinated_dates:
             logger.error(f"❌ El LLM inventó fechas: {hallucinated_dates}")
@@ -906,77 +1642,68 @@ RESPUESTA:"""
         
         return True
     
+    def _clean_generated(self, answer):
+        """Quitar etiquetas <think>/HTML y referencias a documentos de la salida del LLM"""
+        answer = THINK_TAG_RE.sub('', answer.strip())
+        answer = HTML_TAG_RE.sub('', answer)
+        return self._clean_response(answer)
+    
     def _clean_response(self, response):
         """Limpiar respuesta de referencias a documentos internos"""
-        # Eliminar referencias a "DOCUMENTO X"
-        response = re.sub(r'Según el DOCUMENTO \d+[^,.:]*,?\s*', '', response, flags=re.IGNORECASE)
-        response = re.sub(r'En el DOCUMENTO \d+[^,.:]*,?\s*', '', response, flags=re.IGNORECASE)
-        response = re.sub(r'El DOCUMENTO \d+[^,.:]*\s+(indica|dice|menciona|establece)\s+que\s*', '', response, flags=re.IGNORECASE)
-        
-        # Eliminar códigos entre corchetes
-        response = re.sub(r'\[CONV-[A-Z0-9-]+\]', '', response)
-        response = re.sub(r'\[MAT-[A-Z0-9-]+\]', '', response)
-        response = re.sub(r'\[RES-[A-Z0-9-]+\]', '', response)
-        
-        # Eliminar frases como "según el contexto proporcionado"
-        response = re.sub(r'Según el contexto proporcionado,?\s*', '', response, flags=re.IGNORECASE)
-        response = re.sub(r'Basándome en la información proporcionada,?\s*', '', response, flags=re.IGNORECASE)
-        response = re.sub(r'De acuerdo (al|con el) contexto,?\s*', '', response, flags=re.IGNORECASE)
-        
-        # Limpiar espacios múltiples
-        response = re.sub(r'\s+', ' ', response)
+        for pattern, replacement in RESPONSE_CLEANUP_PATTERNS:
+            response = pattern.sub(replacement, response)
         
         return response.strip()
     
-    def _generate_with_ollama(self, prompt, context=None, max_retries=2):
+    def _post_chat(self, system, prompt, temperature, stream=False):
+        """POST a /api/chat por la sesión compartida (mismas opciones para respuesta completa y streaming)"""
+        return _OLLAMA.post(
+            self.ollama_url,
+            data=_json_dumps({
+                "model": self.ollama_model,
+                "messages": self._chat_messages(system, prompt),
+                "stream": stream,
+                "keep_alive": OLLAMA_KEEP_ALIVE,
+                "options": {
+                    "temperature": temperature,
+                    "num_predict": 1500,
+                    "top_p": 0.8,
+                    **OLLAMA_RUNNER_OPTIONS
+                }
+            }),
+            headers=JSON_HEADERS,
+            stream=stream,
+            timeout=180
+        )
+    
+    def _generate_with_ollama(self, system, prompt, context=None, max_retries=2):
         """Generar respuesta con Ollama local"""
         
-        if not self._ensure_ollama_running():
-            raise Exception("Ollama no está disponible. Ejecuta: ollama serve")
+        # Fechas del contexto una sola vez para todos los reintentos
+        context_dates = _canonical_dates(_normalize_text(context), CONTEXT_RANGE_RE) if context else None
         
         for attempt in range(max_retries):
             try:
                 logger.info(f"🤖 Generando con {self.ollama_model} (intento {attempt + 1}/{max_retries})...")
                 start_time = time.time()
                 
-                response = requests.post(
-                    self.ollama_url,
-                    json={
-                        "model": self.ollama_model,
-                        "prompt": prompt,
-                        "stream": False,
-                        "options": {
-                            "temperature": 0.0 if attempt > 0 else 0.1,
-                            "num_predict": 1500,
-                            "top_p": 0.8
-                        }
-                    },
-                    timeout=180
-                )
+                response = self._post_chat(system, prompt, temperature=0.0 if attempt > 0 else 0.1)
                 
                 elapsed = time.time() - start_time
                 logger.info(f"⏱️ Tiempo: {elapsed:.2f}s")
                 
                 if response.status_code == 200:
-                    answer = response.json()['response'].strip()
-                    
-                    # Limpiar respuesta
-                    answer = re.sub(r'<think>.*?</think>', '', answer, flags=re.DOTALL)
-                    answer = re.sub(r'<[^>]+>', '', answer)
-                    answer = self._clean_response(answer)
+                    answer = self._clean_generated(_json_loads(response.content)['message']['content'])
                     
                     # Validar fechas si tenemos contexto
-                    if context and self._validate_dates_in_response(answer, context):
+                    if context and self._validate_dates_in_response(answer, context_dates):
                         return answer
                     elif not context:
                         return answer
                     else:
                         if attempt < max_retries - 1:
                             logger.warning("⚠️ Reintentando con instrucciones más estrictas...")
-                            prompt = prompt.replace(
-                                "INSTRUCCIONES CRÍTICAS:",
-                                "⚠️ ADVERTENCIA: Tu respuesta anterior contenía fechas incorrectas. INSTRUCCIONES CRÍTICAS:"
-                            )
+                            prompt = RETRY_WARNING + prompt
                             continue
                         else:
                             logger.error("❌ Máximo de reintentos alcanzado.")
@@ -984,6 +1711,11 @@ RESPUESTA:"""
                 else:
                     raise Exception(f"Ollama error: {response.status_code}")
                     
+            except requests.ConnectionError as e:
+                logger.warning("⚠️ Ollama no está corriendo")
+                logger.info("💡 Inicia Ollama con: ollama serve")
+                raise Exception("Ollama no está disponible. Ejecuta: ollama serve") from e
+            
             except Exception as e:
                 logger.error(f"Error en Ollama: {e}")
                 if attempt == max_retries - 1:
@@ -991,78 +1723,90 @@ RESPUESTA:"""
         
         return answer
     
+    def _build_context(self, context_docs):
+        """Construir el contexto ENRIQUECIDO que se envía al LLM"""
+        context_parts = []
+        context_tokens = 0
+        
+        # Los documentos llegan ordenados por puntuación: al primero que no califica se corta
+        for idx, doc_wrapper in enumerate(context_docs, 1):
+            if context_parts and doc_wrapper['score'] < MIN_CONTEXT_SCORE:
+                break
+            
+            part = _render_context_doc(idx, doc_wrapper['documento'])
+            part_tokens = len(part.split())
+            if context_parts and context_tokens + part_tokens > MAX_CTX_TOKENS:
+                break
+            
+            context_parts.append(part)
+            context_tokens += part_tokens
+        
+        if len(context_parts) < len(context_docs):
+            logger.info(f"✂️ Contexto con {len(context_parts)} de {len(context_docs)} documentos ({context_tokens} palabras)")
+        
+        context = CONTEXT_HEADER + "\n\n".join(context_parts) + CONTEXT_FOOTER
+        
+        # DEBUG: Ver qué contexto se envía
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "📄 CONTEXTO ENVIADO AL LLM:\n%s",
+                context[:1000] + "..." if len(context) > 1000 else context
+            )
+        
+        return context
+    
     def generate_response(self, query, context_docs):
         """Generar respuesta usando Ollama local"""
         try:
-            # Construir contexto ENRIQUECIDO
-            context_parts = []
-            
-            for idx, doc_wrapper in enumerate(context_docs, 1):
-                doc = doc_wrapper['documento']
-                
-                doc_lines = []
-                
-                # Agregar ENCABEZADO del documento
-                header = f"DOCUMENTO {idx}"
-                if doc.get('id_chunk'):
-                    header += f" [{doc['id_chunk']}]"
-                if doc.get('categoria_principal'):
-                    header += f" - {doc['categoria_principal']}"
-                if doc.get('sub_categoria'):
-                    header += f" > {doc['sub_categoria']}"
-                
-                doc_lines.append(header)
-                doc_lines.append("-" * 50)
-                
-                # Agregar METADATA estructurada
-                if doc.get('actividad_cronograma'):
-                    doc_lines.append(f"📌 Actividad: {doc['actividad_cronograma']}")
-                
-                if doc.get('fecha_relevante'):
-                    doc_lines.append(f"📅 FECHAS: {doc['fecha_relevante']}")
-                
-                if doc.get('lugar_pago'):
-                    doc_lines.append(f"📍 Lugar de pago: {doc['lugar_pago']}")
-                
-                if doc.get('tasa_soles'):
-                    doc_lines.append(f"💰 Costo: S/ {doc['tasa_soles']}")
-                
-                if any([doc.get('actividad_cronograma'), doc.get('fecha_relevante'), 
-                       doc.get('lugar_pago'), doc.get('tasa_soles')]):
-                    doc_lines.append("")
-                
-                # Agregar CONTENIDO
-                doc_lines.append(f"📄 Información: {doc['content']}")
-                
-                context_parts.append("\n".join(doc_lines))
-            
-            # Unir todos los documentos
-            context = "\n\n" + "="*70 + "\n\n".join([""] + context_parts) + "\n\n" + "="*70
-            
-            # DEBUG: Ver qué contexto se envía
-            logger.info("=" * 80)
-            logger.info("📄 CONTEXTO ENVIADO AL LLM:")
-            logger.info(context[:1000] + "..." if len(context) > 1000 else context)
-            logger.info("=" * 80)
+            context = self._build_context(context_docs)
             
-            prompt = self._build_prompt(query, context)
+            system, prompt = self._build_prompt(query, context)
             
             # Generar respuesta con Ollama
-            return self._generate_with_ollama(prompt, context=context)
+            return self._generate_with_ollama(system, prompt, context=context)
         
         except Exception as e:
             logger.error(f"Error en generación: {e}")
-            return "Lo siento, no puedo procesar tu consulta en este momento. Por favor, intenta más tarde."
+            return ERROR_ANSWER
+    
+    def _answer_cache_key(self, question, relevant_docs):
+        question = ' '.join(unicodedata.normalize('NFKC', question).lower().split())
+        return question, tuple(doc['documento'].get('id_chunk') for doc in relevant_docs)
+    
+    def _get_cached_answer(self, key):
+        """Respuesta guardada para la clave si no ha expirado"""
+        with self._answer_cache_lock:
+            entry = self._answer_cache.get(key)
+            if entry is None:
+                return None
+            answer, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._answer_cache[key]
+                return None
+            self._answer_cache.move_to_end(key)
+        
+        logger.info("⚡ Respuesta obtenida de la caché")
+        return answer
+    
+    def _store_answer(self, key, answer):
+        # Los errores de generación no se guardan: el siguiente intento puede funcionar
+        if answer == ERROR_ANSWER:
+            return
+        with self._answer_cache_lock:
+            self._answer_cache[key] = (answer, time.monotonic() + ANSWER_CACHE_TTL)
+            self._answer_cache.move_to_end(key)
+            if len(self._answer_cache) > ANSWER_CACHE_SIZE:
+                self._answer_cache.popitem(last=False)
     
     def get_answer(self, question):
         """Método principal para obtener respuesta"""
         logger.info(f"🔍 Nueva consulta: {question}")
         
-        # Buscar documentos relevantes
+        # Buscar documentos relevantes (el modelo de Ollama ya se precargó al iniciar el servicio)
         relevant_docs = self.search_documents(question)
         
         if not relevant_docs:
-            return "No encontré información relevante para tu consulta. Por favor, reformula tu pregunta."
+            return NO_RESULTS_ANSWER
         
         # Log documentos recuperados
         for i, doc in enumerate(relevant_docs, 1):
@@ -1086,12 +1830,62 @@ RESPUESTA:"""
             logger.info(f"  {i}. {title}")
             logger.info(f"      Score: {doc['score']:.3f} (Sem: {doc['semantic_score']:.2f}, KW: {doc['keyword_score']:.2f})")
         
+        cache_key = self._answer_cache_key(question, relevant_docs)
+        answer = self._get_cached_answer(cache_key)
+        if answer is not None:
+            return answer
+        
         # Generar respuesta
         answer = self.generate_response(question, relevant_docs)
+        self._store_answer(cache_key, answer)
         logger.info(f"✅ Respuesta generada: {len(answer)} caracteres")
         
         return answer
+    
+    def _stream_with_ollama(self, system, prompt, temperature=0.1):
+        """Generar respuesta con Ollama en streaming: produce los fragmentos a medida que llegan"""
+        logger.info(f"🤖 Generando (streaming) con {self.ollama_model}...")
+        
+        with self._post_chat(system, prompt, temperature, stream=True) as response:
+            if response.status_code != 200:
+                raise Exception(f"Ollama error: {response.status_code}")
+            
+            # Ollama envía un objeto JSON por línea
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = _json_loads(line)
+                content = chunk.get('message', {}).get('content')
+                if content:
+                    yield content
+                if chunk.get('done'):
+                    break
+    
+    def stream_answer(self, question):
+        """Versión en streaming de get_answer (sin validación de fechas ni reintentos)"""
+        logger.info(f"🔍 Nueva consulta (streaming): {question}")
+        
+        relevant_docs = self.search_documents(question)
+        
+        if not relevant_docs:
+            yield NO_RESULTS_ANSWER
+            return
+        
+        system, prompt = self._build_prompt(question, self._build_context(relevant_docs))
+        
+        # Las etiquetas <think> se quitan al vuelo; el resto de la limpieza necesita la respuesta completa
+        yield from _strip_think_tags(self._stream_with_ollama(system, prompt))
+
+
+_rag_service_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _create_rag_service():
+    return RAGService()
 
 
-# Instancia global del servicio
-rag_service = RAGService()
\ No newline at end of file
+def get_rag_service():
+    """Instancia única del servicio por proceso, creada en la primera consulta"""
+    with _rag_service_lock:
+        return _create_rag_service()
\ No newline at end of file
@@ -1,3 +1,48 @@
-from django.test import TestCase
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from .rag_service import CONTEXT_RANGE_RE, RAGService, _canonical_dates, _normalize_text, _strip_think_tags
+
+
+class ValidateDatesInResponseTests(SimpleTestCase):
+    """Validación de fechas de la respuesta contra las fechas canónicas del contexto"""
+
+    def setUp(self):
+        # Solo se prueba la validación: sin cargar modelo, índice ni documentos
+        self.service = RAGService.__new__(RAGService)
+
+    def validate(self, response, context):
+        context_dates = _canonical_dates(_normalize_text(context), CONTEXT_RANGE_RE)
+        return self.service._validate_dates_in_response(response, context_dates)
+
+    def test_single_date_in_context(self):
+        context = "La matrícula regular vence el 02 de abril de 2025."
+        self.assertTrue(self.validate("El plazo vence el 2 de abril.", context))
+
+    def test_date_range_in_context(self):
+        context = "Inscripción: 20 al 24 de enero de 2025."
+        self.assertTrue(self.validate("La inscripción es del 20 al 24 de enero.", context))
+
+    def test_date_not_in_context(self):
+        context = "La matrícula regular vence el 02 de abril de 2025."
+        with self.assertLogs('chat_api.rag_service', level='WARNING'):
+            self.assertFalse(self.validate("El plazo vence el 15 de abril.", context))
+
+    def test_response_without_dates(self):
+        context = "La matrícula regular vence el 02 de abril de 2025."
+        self.assertTrue(self.validate("Debes acudir a la oficina de registros académicos.", context))
+
+
+class StripThinkTagsTests(SimpleTestCase):
+    """Bloques <think> quitados del stream aunque las etiquetas lleguen partidas"""
+
+    def test_think_block_removed(self):
+        chunks = ['<think>razono</think>', 'La tasa es S/ 50']
+        self.assertEqual(''.join(_strip_think_tags(chunks)), 'La tasa es S/ 50')
+
+    def test_tags_split_across_chunks(self):
+        chunks = ['<thi', 'nk>razo', 'no</th', 'ink>La tasa', ' es S/ 50']
+        self.assertEqual(''.join(_strip_think_tags(chunks)), 'La tasa es S/ 50')
+
+    def test_text_without_tags_unchanged(self):
+        chunks = ['Costo: 3 < 5', ' <b>ok</b>']
+        self.assertEqual(''.join(_strip_think_tags(chunks)), 'Costo: 3 < 5 <b>ok</b>')
@@ -3,5 +3,6 @@ from . import views
 
 urlpatterns = [
     path('chat/', views.chat_message, name='chat_message'),
+    path('chat/stream/', views.chat_message_stream, name='chat_message_stream'),
     path('history/', views.chat_history, name='chat_history'),
 ]
\ No newline at end of file
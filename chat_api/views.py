@@ -1,12 +1,73 @@
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
+from django.db import close_old_connections
+from django.http import StreamingHttpResponse
 from django.utils import timezone
 from .serializers import ChatRequestSerializer, ChatResponseSerializer
 from .models import ChatMessage
-from .rag_service import rag_service
+from .rag_service import ERROR_ANSWER, get_rag_service
+import logging
+import queue
+import threading
+import time
 import traceback  # ✅ AGREGAR
 
+logger = logging.getLogger(__name__)
+
+# Registro de mensajes fuera del request: un hilo los guarda en lote cada medio segundo
+LOG_FLUSH_INTERVAL = 0.5
+LOG_BATCH_SIZE = 100
+_log_queue = queue.Queue()
+_log_writer_lock = threading.Lock()
+_log_writer_started = False
+
+
+def _save_messages(pending):
+    """Guardar un lote; si bulk_create falla, uno por uno para no perder el resto"""
+    try:
+        ChatMessage.objects.bulk_create(pending, batch_size=LOG_BATCH_SIZE)
+        return
+    except Exception:
+        logger.exception(f"❌ Error guardando {len(pending)} mensajes en lote; se guardan uno por uno")
+    
+    for message in pending:
+        try:
+            message.save()
+        except Exception:
+            logger.exception("❌ Error guardando mensaje de chat")
+
+
+def _log_writer():
+    """Guardar en base de datos, con bulk_create, los mensajes encolados por las vistas"""
+    while True:
+        pending = [_log_queue.get()]
+        time.sleep(LOG_FLUSH_INTERVAL)
+        while True:
+            try:
+                pending.append(_log_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        # El hilo vive lo que el proceso: descartar conexiones caducadas o rotas antes y después del lote
+        close_old_connections()
+        try:
+            _save_messages(pending)
+        finally:
+            close_old_connections()
+
+
+def _enqueue_message(question, answer):
+    """Encolar el mensaje para guardarlo en segundo plano (el hilo se arranca en el primer uso)"""
+    global _log_writer_started
+    if not _log_writer_started:
+        with _log_writer_lock:
+            if not _log_writer_started:
+                threading.Thread(target=_log_writer, name='chat-log-writer', daemon=True).start()
+                _log_writer_started = True
+    _log_queue.put(ChatMessage(question=question, answer=answer))
+
+
 @api_view(['POST'])
 def chat_message(request):
     """
@@ -19,13 +80,10 @@ def chat_message(request):
         
         try:
             # Obtener respuesta del sistema RAG
-            answer = rag_service.get_answer(question)
+            answer = get_rag_service().get_answer(question)
             
-            # Guardar en base de datos
-            chat_message = ChatMessage.objects.create(
-                question=question,
-                answer=answer
-            )
+            # Guardar en base de datos (en segundo plano)
+            _enqueue_message(question, answer)
             
             # Preparar respuesta
             response_data = {
@@ -58,19 +116,45 @@ def chat_message(request):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+def chat_message_stream(request):
+    """
+    Endpoint para procesar mensajes del chat en streaming (texto plano)
+    """
+    serializer = ChatRequestSerializer(data=request.data)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    question = serializer.validated_data['question']
+    
+    def stream():
+        # El estado 200 ya se envió: un error a mitad de respuesta se comunica con ERROR_ANSWER
+        answer_parts = []
+        try:
+            rag_service = get_rag_service()
+            for chunk in rag_service.stream_answer(question):
+                answer_parts.append(chunk)
+                yield chunk
+            answer = rag_service._clean_generated(''.join(answer_parts))
+        except Exception:
+            logger.exception(f"❌ Error generando respuesta en streaming para: {question[:50]}")
+            answer = ERROR_ANSWER
+            yield ("\n\n" if answer_parts else "") + ERROR_ANSWER
+        
+        # Guardar en base de datos cuando termina la respuesta, limpia como en /api/chat/ (en segundo plano)
+        _enqueue_message(question, answer)
+    
+    return StreamingHttpResponse(stream(), content_type='text/plain; charset=utf-8')
+
+
 @api_view(['GET'])
 def chat_history(request):
     """
     Endpoint para obtener historial de chat
     """
-    messages = ChatMessage.objects.all()[:50]
-    data = []
-    
-    for msg in messages:
-        data.append({
-            'question': msg.question,
-            'answer': msg.answer,
-            'timestamp': msg.timestamp
-        })
+    data = list(
+        ChatMessage.objects.order_by('-timestamp').values('question', 'answer', 'timestamp')[:50]
+    )
     
     return Response(data, status=status.HTTP_200_OK)
\ No newline at end of file
@@ -5,6 +5,7 @@ import os
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
 import requests
+import torch
 
 # -----------------------------
 # CONFIGURACIÓN GENERAL
@@ -12,6 +13,18 @@ import requests
 GROQ_API_KEY = ""
 GROQ_MODEL = "llama3-8b-8192"  # puedes cambiar a mixtral-8x7b si deseas
 
+# Parámetros del grafo HNSW
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+INDEX_PATH = "index.faiss"
+MODELO_EMBEDDINGS = "all-MiniLM-L6-v2"
+
+# Índice y modelo se cargan una sola vez por proceso
+_INDEX = None
+_MODELO_EMB = None
+
 # -----------------------------
 # CARGAR Y EMBEDDEAR DOCUMENTOS
 # -----------------------------
@@ -20,19 +33,58 @@ def cargar_dataset(path):
     with open(path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
+def get_modelo_embeddings():
+    global _MODELO_EMB
+    if _MODELO_EMB is None:
+        _MODELO_EMB = SentenceTransformer(MODELO_EMBEDDINGS)
+    return _MODELO_EMB
+
 def generar_embeddings(textos, modelo_emb):
-    return modelo_emb.encode(textos, convert_to_numpy=True, show_progress_bar=True)
+    # Lotes grandes y embeddings ya normalizados; en GPU el forward corre en FP16
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    with torch.inference_mode(), torch.autocast('cuda', dtype=torch.float16, enabled=device == 'cuda'):
+        return modelo_emb.encode(
+            textos,
+            batch_size=256,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+            device=device
+        )
 
 # -------------------------
 # CREAR ÍNDICE FAISS NUEVO
 # -------------------------
 
+def get_index():
+    global _INDEX
+    if _INDEX is None:
+        # Memory-map de los códigos (faiss >= 1.8): varios procesos comparten las mismas páginas del índice
+        io_flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        _INDEX = faiss.read_index(INDEX_PATH, io_flags)
+        # Un índice antiguo (IndexFlatL2) no tiene grafo HNSW
+        if hasattr(_INDEX, 'hnsw'):
+            _INDEX.hnsw.efSearch = HNSW_EF_SEARCH
+    return _INDEX
+
 def crear_indice(embeddings):
+    global _INDEX
+    # Producto interno sobre vectores normalizados = similitud coseno
+    embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+    faiss.normalize_L2(embeddings)
     dimension = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
+    # Vectores guardados en int8 (escala por dimensión); la consulta sigue en float32
+    index = faiss.IndexHNSWSQ(dimension, faiss.ScalarQuantizer.QT_8bit, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+    index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index.train(embeddings)
     index.add(embeddings)
-    faiss.write_index(index, "index.faiss")
+    index.hnsw.efSearch = HNSW_EF_SEARCH
+    # Archivo temporal + os.replace: no truncar el índice que otro proceso tiene mapeado
+    tmp_path = f"{INDEX_PATH}.tmp.{os.getpid()}"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, INDEX_PATH)
     print(f"Índice creado con {len(embeddings)} documentos.")
+    _INDEX = index
     return index
 
 # -------------------------
@@ -65,9 +117,8 @@ def responder_groq(prompt, max_tokens=256):
 # -------------------------
 
 def consultar(query, docs, embeddings, modelo_emb, top_k=3):
-    vec_query = modelo_emb.encode([query], convert_to_numpy=True)
-    index = faiss.read_index("index.faiss")
-    _, indices = index.search(vec_query, top_k)
+    vec_query = modelo_emb.encode([query], convert_to_numpy=True, normalize_embeddings=True).astype('float32')
+    _, indices = get_index().search(vec_query, top_k)
 
     contexto = "\n---\n".join([docs[i]["content"] for i in indices[0]])
     prompt = (
@@ -88,9 +139,9 @@ def main():
     dataset = cargar_dataset("base_normativa_rag.json")
     textos = [doc["content"] for doc in dataset]
 
-    modelo_embeddings = SentenceTransformer("all-MiniLM-L6-v2")
+    modelo_embeddings = get_modelo_embeddings()
 
-    if not Path("index.faiss").exists():
+    if not Path(INDEX_PATH).exists():
         print("Generando embeddings...")
         embeddings = generar_embeddings(textos, modelo_embeddings)
         crear_indice(embeddings)